@@ -1,7 +1,13 @@
 import os
-from flask import Flask, request, jsonify, send_file
+import re
+import json
+import time
+import hashlib
+from flask import Flask, Response, request, jsonify, send_file, stream_with_context
 from flask_cors import CORS, cross_origin
-from main import API_CREATE_VIDEO, API_RETURN_SCRIPT, API_CLEAN_USERCODE
+from main import API_RETURN_SCRIPT, API_CLEAN_USERCODE, DOC_TYPE_INDEX, VIDEO_TYPES, preload_video_types, get_file_caches
+from jobs import Render_Queue, JOB_QUEUED, JOB_RENDERING, JOB_DONE, JOB_FAILED, TIER_PREVIEW, TIER_FULL
+from timing import METRICS
 
 app = Flask(__name__)
 cors = CORS(app)
@@ -13,19 +19,83 @@ CORS(app, resources={r"/cleanup-usercode": {"origins": "*", "methods": ["DELETE"
 # Global constant -> points to dir of project files.
 CURRENT_PROJECT_DIR = os.getcwd()
 
+# Index footage and music once at startup, render workers inherit it.
+preload_video_types()
+
+#Builds a /generate-script response body and its ETag.
+def script_payload(array):
+    body = json.dumps({'script': array}).encode()
+    return body, '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+# Every /generate-script response, built once. Unknown doc types get the {"script": false} payload.
+SCRIPT_PAYLOADS = {video_code: script_payload(API_RETURN_SCRIPT(video_code)) for video_code in VIDEO_TYPES}
+UNKNOWN_SCRIPT_PAYLOAD = script_payload(False)
+
+# Renders run in a pool of worker processes so requests return right away.
+render_queue = Render_Queue()
+
+# Streaming of videos that are still being encoded.
+STREAM_CHUNK_SIZE = 64 * 1024
+STREAM_POLL_SECONDS = 0.25
+
+#Reads bytes [start, end] of a file that a render is still appending to, waiting for bytes that do not exist yet.
+#Stops early if the render ends (or fails) before reaching end. end=None means until the render is done.
+def read_growing_file(path, job_id, start, end=None):
+    with open(path, "rb") as f:
+        f.seek(start)
+        position = start
+        while end is None or position <= end:
+            wanted = STREAM_CHUNK_SIZE if end is None else min(STREAM_CHUNK_SIZE, end - position + 1)
+            chunk = f.read(wanted)
+            if chunk:
+                position += len(chunk)
+                yield chunk
+                continue
+
+            status = render_queue.status(job_id)
+            if status is None or status["status"] in (JOB_DONE, JOB_FAILED):
+                # One last read, the encoder may have written its final bytes since we checked.
+                chunk = f.read(wanted)
+                if not chunk:
+                    return
+                position += len(chunk)
+                yield chunk
+            else:
+                time.sleep(STREAM_POLL_SECONDS)
+
+#Waits until the render has created its output file. Returns False if it never will. While the job is queued the
+#path may still hold an older video of the same usercode, the worker removes it before the job counts as rendering.
+def wait_for_output(path, job_id):
+    while True:
+        status = render_queue.status(job_id)
+        if status is None or status["status"] == JOB_FAILED:
+            return False
+        if status["status"] != JOB_QUEUED and os.path.exists(path):
+            return True
+        if status["status"] == JOB_DONE:
+            return False
+        time.sleep(STREAM_POLL_SECONDS)
+
 @app.route("/generate-video", methods=["POST"])
 @cross_origin()
 def generate_video():
     """
-    Generate a video from backend based on the provided user ID and list of words.
+    Queue a video for generation based on the provided user ID and list of words.
 
     Request Body (JSON):
         - user_id (str): The ID of the user.
         - strings (list): List of strings used to generate the video.
+        - deterministic (bool, optional): Pick shots from a seed derived from the words, so identical requests give
+          identical videos that can be served from cache or share a single render.
+        - seed (int, optional): Seed to use instead of the derived one. Implies deterministic.
+        - preview (bool, optional): Render a low resolution preview first, fetched with /video-result?tier=preview
+          while the full quality video is still rendering.
 
     Returns:
-        - If successful, returns the generated video file as an attachment with a status code of 200.
-        - If video generation fails, returns an error message with a status code of 404.
+        - If the video type is known, returns the job ID and its queue status with a status code of 202.
+        - If deterministic or preview is not a boolean, or seed is not an integer, returns an error message
+          with a status code of 400.
+        - If the video type is unknown, returns an error message with a status code of 404.
     """
 
     # Get user_id
@@ -34,15 +104,134 @@ def generate_video():
     # Get the list of strings from the JSON request body
     list_of_strings = request.json.get('strings', [])
 
-    print("\n\nGenerating video from request under ID: ", user_id)
+    # Reject unknown video types before they take up a spot in the queue
+    if not list_of_strings or not API_RETURN_SCRIPT(list_of_strings[DOC_TYPE_INDEX]):
+        return jsonify({"error": "Video Generation failed"}), 404
 
-    # Call the function with the user_id and list_of_strings
-    if API_CREATE_VIDEO(user_id, list_of_strings):
-        # Return the generated video as a response!
-        return send_file(CURRENT_PROJECT_DIR + "/user_output/" + user_id + "/" + user_id + ".mp4", as_attachment=True, download_name='generated_video.mp4'), 200
-    else:
+    seed = request.json.get('seed')
+    deterministic = request.json.get('deterministic', False)
+    preview = request.json.get('preview', False)
+
+    # JSON types only: bool("false") is True, and int() would fail on "abc" and truncate 1.5.
+    if not isinstance(deterministic, bool) or not isinstance(preview, bool):
+        return jsonify({"error": "deterministic and preview must be true or false"}), 400
+    if seed is not None and (isinstance(seed, bool) or not isinstance(seed, int)):
+        return jsonify({"error": "seed must be an integer"}), 400
+    deterministic = deterministic or seed is not None
+
+    print("\n\nQueueing video from request under ID: ", user_id)
+
+    job_id = render_queue.submit(user_id, list_of_strings, deterministic, seed, preview)
+    return jsonify(render_queue.status(job_id)), 202
+
+
+@app.route("/video-status/<job_id>", methods=["GET"])
+@cross_origin()
+def video_status(job_id):
+    """
+    Report how far along a queued video is.
+
+    Returns:
+        - If the job exists, returns its status ("queued", "rendering", "done" or "failed"),
+          progress (0 to 1), queue position and tier (the best video ready: "preview", "full" or null)
+          with a status code of 200.
+        - If the job is unknown, returns an error message with a status code of 404.
+    """
+
+    status = render_queue.status(job_id)
+    if status is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(status), 200
+
+
+@app.route("/video-result/<job_id>", methods=["GET"])
+@cross_origin()
+def video_result(job_id):
+    """
+    Fetch the finished video of a job.
+
+    Query Parameters:
+        - tier (str, optional): "full" (default) or "preview", the low resolution render of jobs queued with preview.
+
+    Returns:
+        - If the requested tier is ready, returns the video file as an attachment with a status code of 200.
+        - If the job is still queued or rendering, returns its status with a status code of 409.
+        - If the job is unknown or failed, returns an error message with a status code of 404.
+    """
+
+    status = render_queue.status(job_id)
+    if status is None or status["status"] == JOB_FAILED:
+        return jsonify({"error": "Video Generation failed"}), 404
+
+    if request.args.get("tier", TIER_FULL) == TIER_PREVIEW:
+        path = render_queue.preview_path(job_id)
+        if path is None:
+            # Not asked for, or not rendered yet. Done jobs that never had a preview have nothing more to wait for.
+            if status["status"] == JOB_DONE:
+                return jsonify({"error": "Job has no preview"}), 404
+            return jsonify(status), 409
+        return send_file(path, as_attachment=True, download_name='generated_video_preview.mp4'), 200
+
+    if status["status"] != JOB_DONE:
+        return jsonify(status), 409
+
+    return send_file(render_queue.result_path(job_id), as_attachment=True, download_name='generated_video.mp4'), 200
+
+
+@app.route("/video-stream/<job_id>", methods=["GET"])
+@cross_origin()
+def video_stream(job_id):
+    """
+    Stream a video while it is still being encoded (fragmented MP4), so playback can start before the render ends.
+
+    Headers:
+        - Range (optional): a single "bytes=start-end" range. While rendering, a range is answered with the bytes
+          that exist so far (total size "*"), waiting for the first requested byte if needed.
+
+    Returns:
+        - Without a range, the video bytes as they are produced with a status code of 200.
+        - With a range, the requested bytes with a status code of 206.
+        - If the job is unknown or failed, returns an error message with a status code of 404.
+        - If the range starts past the end of a finished video, returns a status code of 416.
+    """
+
+    status = render_queue.status(job_id)
+    if status is None or status["status"] == JOB_FAILED:
         return jsonify({"error": "Video Generation failed"}), 404
 
+    path = render_queue.output_path(job_id)
+    if status["status"] == JOB_DONE:
+        # Finished files are static, werkzeug handles ranges and caching for us.
+        return send_file(path, mimetype="video/mp4", conditional=True)
+
+    if not wait_for_output(path, job_id):
+        return jsonify({"error": "Video Generation failed"}), 404
+
+    headers = {"Accept-Ranges": "bytes", "Cache-Control": "no-store"}
+    match = re.fullmatch(r"bytes=(\d+)-(\d*)", request.headers.get("Range", "").strip())
+    if match is None:
+        body = read_growing_file(path, job_id, 0)
+        return Response(stream_with_context(body), 200, headers, mimetype="video/mp4")
+
+    start = int(match.group(1))
+    end = int(match.group(2)) if match.group(2) else None
+
+    # Wait for the first requested byte, then answer with what is there. Players ask again for the rest.
+    rendering = True
+    while rendering and os.path.getsize(path) <= start:
+        status = render_queue.status(job_id)
+        rendering = status is not None and status["status"] in (JOB_QUEUED, JOB_RENDERING)
+        if rendering:
+            time.sleep(STREAM_POLL_SECONDS)
+    size = os.path.getsize(path)
+    if start >= size:
+        return Response(status=416, headers={"Content-Range": "bytes */%d" % size})
+
+    end = size - 1 if end is None else min(end, size - 1)
+    headers["Content-Range"] = "bytes %d-%d/%s" % (start, end, "*" if rendering else size)
+    headers["Content-Length"] = str(end - start + 1)
+    return Response(stream_with_context(read_growing_file(path, job_id, start, end)), 206, headers, mimetype="video/mp4")
+
 
 @app.route("/cleanup-usercode", methods=["DELETE"])
 @cross_origin()
@@ -78,8 +267,12 @@ def generate_script():
     Query Parameters:
         - input_string (str): The input string used to generate the array.
 
+    Headers:
+        - If-None-Match (optional): ETag of a previous response for the same type.
+
     Returns:
-        - If successful, returns the generated array as a JSON response with a status code of 200.
+        - If successful, returns the generated array as a JSON response with a status code of 200, and its ETag.
+        - If the client already has this array (its ETag matches), returns an empty response with a status code of 304.
         - If the input string parameter is missing, returns an error message with a status code of 400.
     """
 
@@ -90,13 +283,33 @@ def generate_script():
     if not input_string:
         return jsonify({'error': 'Input string parameter is required'}), 400
 
-    print(API_RETURN_SCRIPT(input_string))
+    # Responses are built at startup, see SCRIPT_PAYLOADS
+    body, etag = SCRIPT_PAYLOADS.get(input_string, UNKNOWN_SCRIPT_PAYLOAD)
+    if etag in request.headers.get('If-None-Match', ''):
+        response = Response(status=304)
+    else:
+        response = Response(body, status=200, mimetype='application/json')
+    response.headers['ETag'] = etag
+    response.headers['Cache-Control'] = 'no-cache' # Browsers may keep it but must check the ETag first
+    return response
 
-    # Parse the string into an array (assuming the string is comma-separated)
-    array = API_RETURN_SCRIPT(input_string)
+@app.route("/metrics", methods=["GET"])
+@cross_origin()
+def metrics():
+    """
+    Report how long each stage of the render pipeline takes.
+
+    Returns:
+        - Per-stage histograms (count, total/mean/max seconds, bytes and media seconds processed, bucket counts),
+          the number of jobs in each state, the render memory/handle budget in use, and for each file cache its
+          hits, misses and evictions across all renders plus its current size, with a status code of 200.
+    """
 
-    # Return the array as a JSON response
-    return jsonify({'script': array}), 200
+    # Counters come from the render workers, sizes from the cache directories.
+    totals = METRICS.cache_snapshot()
+    caches = {name: dict(cache.stats(), **totals.get(name, {})) for name, cache in get_file_caches().items()}
+    return jsonify({"stages": METRICS.snapshot(), "jobs": render_queue.counts(), "budget": render_queue.budget_status(),
+                    "caches": caches}), 200
 
 # Run the server...
 if __name__ == "__main__":
@@ -0,0 +1,137 @@
+# Standard python imports
+import os
+import time
+import threading
+
+# Moviepy module imports
+from moviepy.video.io.ffmpeg_reader import ffmpeg_parse_infos
+
+from ingest import normalized_path
+
+# Seconds between checks of the footage and music folders for changes.
+REFRESH_INTERVAL = 2.0
+
+#Reads the facts we need about a media file from ffprobe style output, without decoding any frames.
+def probe_media(path):
+    infos = ffmpeg_parse_infos(path)
+    return {
+        "path": path,
+        "name": os.path.basename(path),
+        "duration": infos["duration"],
+        "size": infos.get("video_size"), # [width, height], None for audio
+        "fps": infos.get("video_fps"),
+        "audio": infos["audio_found"],
+        "source": path,
+        "normalized": False,
+    }
+
+def _list_files(directory_path):
+    try:
+        return sorted(item.path for item in os.scandir(directory_path) if item.is_file())
+    except FileNotFoundError:
+        return []
+
+#In-memory index of every shot and music track, so shot selection and length planning never touch the disk.
+#Shots are keyed by (video type, shot type), music tracks by file name. When ingest.py has produced an up to date
+#normalized copy of a shot, its entry points at that copy and keeps the original under "source".
+class Asset_Catalog:
+    def __init__(self, project_dir, video_types, shot_directories):
+        self.project_dir = project_dir
+        self.video_types = list(video_types)
+        self.shot_directories = dict(shot_directories)
+        self.shots = {}
+        self.music = {}
+        self.probes = {} # path -> (stat, entry), reused for files that did not change
+        self.signature = None
+        self.last_check = 0.0
+        self.lock = threading.Lock()
+        self.refresh()
+
+    def _shot_folder(self, video_type, shot_type):
+        return self.project_dir + "footage/" + video_type + "/" + self.shot_directories[shot_type] + "/"
+
+    def _music_folder(self):
+        return self.project_dir + "music/"
+
+    def _scan(self):
+        files = {}
+        for video_type in self.video_types:
+            for shot_type in self.shot_directories:
+                files[(video_type, shot_type)] = _list_files(self._shot_folder(video_type, shot_type))
+        files["music"] = _list_files(self._music_folder())
+        return files
+
+    #Stat of each file, plus the modification time of its normalized copy (None if there is no fresh one).
+    def _stat(self, files):
+        stats = {}
+        for key, paths in files.items():
+            for path in paths:
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                normalized_mtime = None
+                if key != "music":
+                    try:
+                        normalized_mtime = os.stat(normalized_path(self.project_dir, path)).st_mtime_ns
+                    except FileNotFoundError:
+                        pass
+                    if normalized_mtime is not None and normalized_mtime < stat.st_mtime_ns:
+                        normalized_mtime = None # Stale, the original changed after ingest
+                stats[path] = (stat.st_mtime_ns, stat.st_size, normalized_mtime)
+        return stats
+
+    def _probe(self, path, stat):
+        cached = self.probes.get(path)
+        if cached is not None and cached[0] == stat:
+            return cached[1]
+        try:
+            if stat[2] is not None:
+                entry = probe_media(normalized_path(self.project_dir, path))
+                entry["source"] = path
+                entry["normalized"] = True
+            else:
+                entry = probe_media(path)
+        except Exception as e:
+            print(f"Skipping unreadable asset {path}: {e}")
+            entry = None
+        self.probes[path] = (stat, entry)
+        return entry
+
+    #Rebuilds the index, probing only files that are new or changed since the last build.
+    def refresh(self):
+        with self.lock:
+            files = self._scan()
+            stats = self._stat(files)
+            shots = {}
+            for key, paths in files.items():
+                entries = [self._probe(path, stats[path]) for path in paths if path in stats]
+                entries = [entry for entry in entries if entry is not None]
+                if key == "music":
+                    music = {entry["name"]: entry for entry in entries}
+                else:
+                    shots[key] = entries
+
+            self.probes = {path: probe for path, probe in self.probes.items() if path in stats}
+            self.shots = shots
+            self.music = music
+            self.signature = stats
+            self.last_check = time.monotonic()
+
+    #Cheap check (a directory listing and stat per file, no probing) that refreshes the index when assets changed.
+    def refresh_if_changed(self):
+        if time.monotonic() - self.last_check < REFRESH_INTERVAL:
+            return False
+        stats = self._stat(self._scan())
+        self.last_check = time.monotonic()
+        if stats == self.signature:
+            return False
+        self.refresh()
+        return True
+
+    #Returns a fresh list of shot entries that callers are free to pop from.
+    def shot_list(self, video_type, shot_type):
+        return list(self.shots.get((video_type, shot_type), []))
+
+    def music_track(self, name):
+        return self.music.get(name)
@@ -0,0 +1,103 @@
+# In memory audio: dialogue is decoded to PCM as soon as it is downloaded, music is decoded once per track into a
+# memory mapped "bed", and a render's whole soundtrack is mixed with NumPy and piped into the encoder. No line of
+# dialogue is ever written to user_output/, and no music is decoded or attenuated per request.
+
+# Standard python imports
+import os
+import threading
+import subprocess
+
+import numpy as np
+from moviepy.config import get_setting
+
+from cache import cache_key
+from render_plan import DIALOGUE_INPUT
+
+# Format of every PCM buffer: float32 samples, interleaved as [frames, channels].
+SAMPLE_RATE = 44100
+CHANNELS = 2
+SAMPLE_FORMAT = "f32le"
+
+#ffmpeg input arguments that read a PCM buffer from stdin.
+def pcm_input_args():
+    return ["-f", SAMPLE_FORMAT, "-ar", str(SAMPLE_RATE), "-ac", str(CHANNELS), "-i", "pipe:0"]
+
+#The buffer's raw bytes, without copying it if it is already float32 and contiguous.
+def pcm_bytes(pcm):
+    return memoryview(np.ascontiguousarray(pcm, dtype=np.float32)).cast("B")
+
+#Decodes to PCM through an ffmpeg pipe. input_args name the input, data (optional) is written to stdin.
+def decode(input_args, data=None):
+    result = subprocess.run(
+        [get_setting("FFMPEG_BINARY"), "-loglevel", "error", *input_args,
+         "-f", SAMPLE_FORMAT, "-ar", str(SAMPLE_RATE), "-ac", str(CHANNELS), "pipe:1"],
+        input=data, stdin=subprocess.DEVNULL if data is None else None, capture_output=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError("Audio decode failed: " + result.stderr.decode(errors="replace").strip())
+    return np.frombuffer(result.stdout, dtype=np.float32).reshape(-1, CHANNELS)
+
+#Decodes a complete MP3 (bytes) to PCM, no temporary files.
+def decode_mp3(data):
+    return decode(["-f", "mp3", "-i", "pipe:0"], data)
+
+### MUSIC BEDS ###
+
+#Music decoded and attenuated once, saved as .npy files and memory mapped. The OS shares the pages between every
+#render process, and a render only touches the part of the track it plays.
+class Music_Beds:
+    def __init__(self, directory):
+        self.directory = directory
+        self.beds = {}
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    #Returns the track at the given gain as a read only [frames, channels] array, decoding it on first use.
+    #Beds are keyed on the file's size and mtime, so replacing a track decodes it again.
+    def get(self, path, gain):
+        stat = os.stat(path)
+        key = cache_key({"path": os.path.abspath(path), "size": stat.st_size, "mtime": stat.st_mtime_ns,
+                         "gain": gain, "rate": SAMPLE_RATE, "channels": CHANNELS})
+        with self.lock:
+            bed = self.beds.get(key)
+        if bed is not None:
+            return bed
+
+        bed_path = os.path.join(self.directory, key + ".npy")
+        if not os.path.exists(bed_path):
+            pcm = decode(["-i", path])
+            if gain != 1.0:
+                pcm = pcm * np.float32(gain)
+            #Written under a temporary name, other processes only ever see complete beds.
+            temp_path = "%s.%d.%d.tmp.npy" % (bed_path[:-len(".npy")], os.getpid(), threading.get_ident())
+            np.save(temp_path, pcm)
+            os.replace(temp_path, bed_path)
+        bed = np.load(bed_path, mmap_mode="r")
+        with self.lock:
+            self.beds[key] = bed
+        return bed
+
+### MIXING ###
+
+#Adds pcm onto mixed starting at frame `start`, cutting off whatever falls outside of it.
+def add_at(mixed, pcm, start):
+    end = min(len(mixed), start + len(pcm))
+    if end > start:
+        mixed[start:end] += pcm[:end - start]
+
+#Mixes every audio track of a plan onto one buffer, as long as the video. dialogue is the decoded PCM of each line,
+#placed at plan.voice_starts. Music comes from the (already attenuated) beds.
+def mix_soundtrack(plan, dialogue, music_beds):
+    mixed = np.zeros((int(round(plan.length * SAMPLE_RATE)), CHANNELS), dtype=np.float32)
+    for track in plan.audio:
+        start = int(round(track.start * SAMPLE_RATE))
+        if track.path == DIALOGUE_INPUT:
+            for pcm, voice_start in zip(dialogue, plan.voice_starts):
+                add_at(mixed, pcm if track.gain == 1.0 else pcm * np.float32(track.gain), start + int(round(voice_start * SAMPLE_RATE)))
+            continue
+
+        bed = music_beds.get(track.path, track.gain)
+        in_frame = int(round(track.in_point * SAMPLE_RATE))
+        out_frame = len(bed) if track.out_point is None else int(round(track.out_point * SAMPLE_RATE))
+        add_at(mixed, bed[in_frame:out_frame], start)
+    return mixed
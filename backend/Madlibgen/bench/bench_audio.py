@@ -0,0 +1,89 @@
+# Compares the CPU cost of a render's audio stage, mixed per request from files in ffmpeg (decode every track,
+# volume, amix) against the in memory path (decode the dialogue, mix it onto the pre-decoded music bed with NumPy).
+# Both end with the same AAC encode, so the difference is what pre-mixed music beds save.
+#
+# Usage (from backend/Madlibgen): python -m bench.bench_audio --lines 4 --voice-seconds 12 --runs 5
+
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+from bench.bench_e2e import ffmpeg, cpu_seconds
+
+#Runs work `runs` times, returns the median wall and CPU seconds (this process and its ffmpeg children).
+def measure(work, runs):
+    walls, cpus = [], []
+    for _ in range(runs):
+        cpu = cpu_seconds()
+        start = time.perf_counter()
+        work()
+        walls.append(time.perf_counter() - start)
+        cpus.append(cpu_seconds() - cpu)
+    return statistics.median(walls), statistics.median(cpus)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the audio stage before and after pre-mixed music beds.")
+    parser.add_argument("--lines", type=int, default=4, help="Lines of dialogue")
+    parser.add_argument("--voice-seconds", type=float, default=12, help="Length of each line")
+    parser.add_argument("--music-seconds", type=float, default=180, help="Length of the music track")
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    from audio import Music_Beds, decode_mp3, mix_soundtrack
+    from render import run_ffmpeg, soundtrack_command, pcm_bytes
+    from render_plan import (Render_Plan, Shot_Segment, Audio_Track, Output_Settings, DIALOGUE_INPUT,
+                             VOICE_START_SECONDS, VOICE_GAP_SECONDS, MUSIC_GAIN)
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        voice_paths = []
+        for line in range(args.lines):
+            voice_paths.append(os.path.join(work_dir, "voice%d.mp3" % line))
+            ffmpeg("-f", "lavfi", "-i", "sine=frequency=%d:duration=%s" % (300 + 40 * line, args.voice_seconds),
+                   "-ac", "1", "-b:a", "128k", voice_paths[-1])
+        music_path = os.path.join(work_dir, "music.mp3")
+        ffmpeg("-f", "lavfi", "-i", "sine=frequency=220:duration=%s" % args.music_seconds, "-ac", "2", music_path)
+        voice_mp3s = []
+        for path in voice_paths:
+            with open(path, "rb") as f:
+                voice_mp3s.append(f.read())
+
+        #Same layout as build_render_plan.
+        starts = [VOICE_START_SECONDS + line * (args.voice_seconds + VOICE_GAP_SECONDS) for line in range(args.lines)]
+        length = starts[-1] + args.voice_seconds + VOICE_GAP_SECONDS
+        shots = [Shot_Segment(path="unused.mp4", in_point=0.0, out_point=length)]
+        music = Audio_Track(path=music_path, start=0.0, gain=MUSIC_GAIN, out_point=length, kind="music")
+        output = Output_Settings(path=os.path.join(work_dir, "out.mp4"))
+        plan_from_files = Render_Plan(shots=shots, output=output,
+                                      audio=[Audio_Track(path=path, start=start) for path, start in zip(voice_paths, starts)] + [music])
+        plan_in_memory = Render_Plan(shots=shots, output=output, voice_starts=starts,
+                                     audio=[Audio_Track(path=DIALOGUE_INPUT, start=0.0), music])
+        soundtrack_path = os.path.join(work_dir, "soundtrack.m4a")
+
+        beds = Music_Beds(os.path.join(work_dir, "beds"))
+        bed_wall, bed_cpu = measure(lambda: Music_Beds(beds.directory).get(music_path, MUSIC_GAIN), 1)
+
+        def from_files():
+            run_ffmpeg(soundtrack_command(plan_from_files, soundtrack_path))
+
+        def in_memory():
+            dialogue = [decode_mp3(mp3) for mp3 in voice_mp3s]
+            soundtrack = mix_soundtrack(plan_in_memory, dialogue, beds)
+            run_ffmpeg(soundtrack_command(plan_in_memory, soundtrack_path, True), pcm_bytes(soundtrack))
+
+        dialogue = [decode_mp3(mp3) for mp3 in voice_mp3s]
+        beds.get(music_path, MUSIC_GAIN)
+        mix_wall, mix_cpu = measure(lambda: mix_soundtrack(plan_in_memory, dialogue, beds), args.runs)
+        encode_wall, encode_cpu = measure(
+            lambda: run_ffmpeg(soundtrack_command(plan_in_memory, soundtrack_path, True), pcm_bytes(mix_soundtrack(plan_in_memory, dialogue, beds))),
+            args.runs)
+        before_wall, before_cpu = measure(from_files, args.runs)
+        after_wall, after_cpu = measure(in_memory, args.runs)
+
+    print("%.0fs soundtrack, %d lines, %.0fs of music" % (length, args.lines, args.music_seconds))
+    print("music bed (once per track)     wall %6.3fs  cpu %6.3fs" % (bed_wall, bed_cpu))
+    print("before: ffmpeg amix from files wall %6.3fs  cpu %6.3fs" % (before_wall, before_cpu))
+    print("after:  decode + NumPy + AAC   wall %6.3fs  cpu %6.3fs  (%.0f%% of before)" % (after_wall, after_cpu, 100 * after_cpu / before_cpu))
+    print("        NumPy mix alone        wall %6.3fs  cpu %6.3fs" % (mix_wall, mix_cpu))
+    print("        mix + AAC encode       wall %6.3fs  cpu %6.3fs" % (encode_wall, encode_cpu))
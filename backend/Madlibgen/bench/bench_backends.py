@@ -0,0 +1,96 @@
+# Compares wall time and peak memory of the render backends on the same plan.
+#
+# Usage (from backend/Madlibgen): python -m bench.bench_backends --type space_doc --runs 3
+# Each render runs in a fresh process so peak RSS numbers do not bleed into each other.
+
+import argparse
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import time
+
+def run_child(backend, plan_path):
+    import numpy as np
+    import render # Imported here so the parent process stays small
+    from render_plan import Render_Plan
+
+    with open(plan_path) as f:
+        plan = Render_Plan.from_json(f.read())
+    soundtrack = np.load(soundtrack_path(plan_path))
+    start = time.perf_counter()
+    render.RENDER_BACKENDS[backend](plan, None, soundtrack)
+    wall = time.perf_counter() - start
+
+    # ru_maxrss is in kilobytes on Linux. Children covers the ffmpeg processes either backend starts.
+    print(json.dumps({
+        "wall_seconds": wall,
+        "python_peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "ffmpeg_peak_rss_mb": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+    }))
+
+#The premixed soundtrack is saved next to the plan, plans only say where its lines go.
+def soundtrack_path(plan_path):
+    return plan_path + ".npy"
+
+#Synthesizes dialogue through the stand-in TTS server and writes the resulting plan and soundtrack to disk.
+def build_plan(video_type_name, usercode, plan_path):
+    import numpy as np
+    import main
+    from audio import mix_soundtrack
+    from bench.fake_tts import Fake_TTS_Server
+
+    server = Fake_TTS_Server(("127.0.0.1", 0))
+    server.start()
+    main.ELEVENLABS_URL = server.url
+
+    video_types = {video_type().video_code: video_type for video_type in (main.Nature_Doc, main.Space_Doc, main.Corporate_Intro)}
+    video_type = video_types[video_type_name]()
+    script = video_type.generate_script(video_type.empty_array[:1] + ["word"] * (len(video_type.empty_array) - 1))
+    os.makedirs(main.CURRENT_PROJECT_DIR + "user_output/" + usercode, exist_ok=True)
+    dialogue = main.synthesize_dialogue(script, video_type.voice_code)
+    plan = main.plan_clip(usercode, dialogue, video_type)
+    server.shutdown()
+
+    with open(plan_path, "w") as f:
+        f.write(plan.to_json())
+    np.save(soundtrack_path(plan_path), mix_soundtrack(plan, [line["pcm"] for line in dialogue], main.get_music_beds()))
+    return main
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the moviepy and ffmpeg render backends.")
+    parser.add_argument("--type", default="space_doc", help="Video type to render")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--plan", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child, args.plan)
+        sys.exit(0)
+
+    usercode = "bench_backends"
+    plan_path = os.getcwd() + "/user_output/" + usercode + "_plan.json"
+    main = build_plan(args.type, usercode, plan_path)
+    from render import RENDER_BACKENDS
+
+    try:
+        for backend in RENDER_BACKENDS:
+            results = []
+            for _ in range(args.runs):
+                output = subprocess.run(
+                    [sys.executable, "-m", "bench.bench_backends", "--child", backend, "--plan", plan_path],
+                    check=True, capture_output=True, text=True
+                ).stdout
+                results.append(json.loads(output.strip().splitlines()[-1]))
+            print("%-8s wall median %.2fs | peak RSS python %.0f MB, ffmpeg %.0f MB" % (
+                backend,
+                statistics.median(r["wall_seconds"] for r in results),
+                max(r["python_peak_rss_mb"] for r in results),
+                max(r["ffmpeg_peak_rss_mb"] for r in results)))
+    finally:
+        main.API_CLEAN_USERCODE(usercode)
+        os.remove(plan_path)
+        os.remove(soundtrack_path(plan_path))
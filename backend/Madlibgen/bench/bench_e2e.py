@@ -0,0 +1,245 @@
+# End-to-end render benchmark: synthetic footage and music, a stand-in TTS server, N concurrent users.
+#
+# Usage (from backend/Madlibgen):
+#   python -m bench.bench_e2e --mode api --users 4 --renders 3 --label before
+#   python -m bench.bench_e2e --mode http --users 4 --renders 3 --label after --compare bench/results/before.json
+#
+# "api" calls API_CREATE_VIDEO from threads in this process, "http" goes through the Flask routes and the render
+# queue. Results are written to bench/results/<label>.json so runs can be compared.
+
+import argparse
+import json
+import os
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+MADLIBGEN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(MADLIBGEN_DIR, "bench", "results")
+
+# A render counts as a regression when it is this much slower than the baseline.
+REGRESSION_THRESHOLD = 0.10
+
+### SYNTHETIC PROJECT ###
+
+def ffmpeg(*args):
+    from moviepy.config import get_setting
+    subprocess.run([get_setting("FFMPEG_BINARY"), "-y", "-loglevel", "error", *args], check=True)
+
+#Builds footage/ and music/ folders for every video type, filled with generated test patterns and tones.
+def build_project(project_dir, video_types, shot_directories, clips_per_folder, seconds, size, fps):
+    for video_type in video_types:
+        for folder in shot_directories.values():
+            path = os.path.join(project_dir, "footage", video_type.video_code, folder)
+            os.makedirs(path, exist_ok=True)
+            for clip in range(clips_per_folder):
+                ffmpeg("-f", "lavfi", "-i", "testsrc2=size=%s:rate=%s" % (size, fps), "-t", str(seconds),
+                       "-pix_fmt", "yuv420p", os.path.join(path, "clip-%d.mp4" % clip))
+
+        os.makedirs(os.path.join(project_dir, "music"), exist_ok=True)
+        music_path = os.path.join(project_dir, "music", video_type.music)
+        if not os.path.exists(music_path):
+            ffmpeg("-f", "lavfi", "-i", "sine=frequency=220:duration=180", music_path)
+    os.makedirs(os.path.join(project_dir, "user_output"), exist_ok=True)
+
+#A spoken line stand-in: a short tone, encoded once and returned for every TTS request.
+def build_voice_mp3(project_dir, seconds):
+    path = os.path.join(project_dir, "voice.mp3")
+    ffmpeg("-f", "lavfi", "-i", "sine=frequency=440:duration=%s" % seconds, "-ac", "1", "-b:a", "128k", path)
+    with open(path, "rb") as f:
+        return f.read()
+
+### DRIVERS ###
+
+def words_for(video_type, render_index, repeat_words):
+    # Unique words per render keep the TTS cache from hiding synthesis costs, unless asked otherwise.
+    word = "word" if repeat_words else "word%d" % render_index
+    return [video_type.video_code] + [word] * (len(video_type.empty_array) - 1)
+
+def render_api(main, usercode, gen_args):
+    if not main.API_CREATE_VIDEO(usercode, gen_args):
+        raise RuntimeError("API_CREATE_VIDEO failed for " + gen_args[0])
+
+def render_http(client, usercode, gen_args):
+    response = client.post("/generate-video", json={"user_id": usercode, "strings": gen_args})
+    if response.status_code != 202:
+        raise RuntimeError("POST /generate-video returned %d" % response.status_code)
+    job_id = response.get_json()["job_id"]
+    while True:
+        status = client.get("/video-status/" + job_id).get_json()
+        if status["status"] == "failed":
+            raise RuntimeError(status["error"])
+        if status["status"] == "done":
+            break
+        time.sleep(0.1)
+    response = client.get("/video-result/" + job_id)
+    if response.status_code != 200:
+        raise RuntimeError("GET /video-result returned %d" % response.status_code)
+    response.close()
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+def cpu_seconds():
+    total = 0.0
+    for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN):
+        usage = resource.getrusage(who)
+        total += usage.ru_utime + usage.ru_stime
+    return total
+
+#Wraps a render that returns nothing into one that returns its latency, keyed by video type. See run_load.
+def timed_by_type(render):
+    def timed(usercode, gen_args):
+        start = time.perf_counter()
+        render(usercode, gen_args)
+        return {gen_args[0]: time.perf_counter() - start}
+    return timed
+
+#Runs `users` threads that each render `renders` videos back to back. render(usercode, gen_args) returns a dict of
+#named latencies in seconds, run_load returns every latency under its name.
+def run_load(render, video_types, users, renders, repeat_words, clean):
+    latencies = {}
+    errors = []
+    lock = threading.Lock()
+
+    def user(user_index):
+        for render_index in range(renders):
+            video_type = video_types[(user_index + render_index) % len(video_types)]
+            usercode = "bench_%d_%d" % (user_index, render_index)
+            gen_args = words_for(video_type, user_index * renders + render_index, repeat_words)
+            try:
+                timings = render(usercode, gen_args)
+            except Exception as e:
+                with lock:
+                    errors.append(str(e))
+                continue
+            with lock:
+                for name, seconds in timings.items():
+                    latencies.setdefault(name, []).append(seconds)
+            clean(usercode)
+
+    threads = [threading.Thread(target=user, args=(index,)) for index in range(users)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors
+
+### REPORTING ###
+
+def summarize(latencies):
+    if not latencies:
+        return None
+    return {
+        "renders": len(latencies),
+        "p50_seconds": round(percentile(latencies, 0.50), 3),
+        "p95_seconds": round(percentile(latencies, 0.95), 3),
+        "mean_seconds": round(statistics.mean(latencies), 3),
+    }
+
+def compare(results, baseline):
+    print("\nCompared with " + baseline["label"] + ":")
+    regressions = 0
+    for key, current in results["types"].items():
+        previous = baseline["types"].get(key)
+        if not current or not previous:
+            continue
+        for metric in ("p50_seconds", "p95_seconds"):
+            change = (current[metric] - previous[metric]) / previous[metric]
+            flag = "  REGRESSION" if change > REGRESSION_THRESHOLD else ""
+            regressions += bool(flag)
+            print("  %-16s %-12s %8.3fs -> %8.3fs (%+.1f%%)%s" % (key, metric, previous[metric], current[metric], change * 100, flag))
+    change = (results["throughput_per_minute"] - baseline["throughput_per_minute"]) / baseline["throughput_per_minute"]
+    print("  throughput %.2f -> %.2f renders/min (%+.1f%%)" % (baseline["throughput_per_minute"], results["throughput_per_minute"], change * 100))
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="End-to-end render benchmark.")
+    parser.add_argument("--mode", choices=["api", "http"], default="api")
+    parser.add_argument("--types", nargs="+", help="Video types to render, defaults to all implemented types")
+    parser.add_argument("--users", type=int, default=2, help="Concurrent users")
+    parser.add_argument("--renders", type=int, default=2, help="Renders per user")
+    parser.add_argument("--latency", type=float, default=0.8, help="Stand-in TTS delay per request, in seconds")
+    parser.add_argument("--voice-seconds", type=float, default=8, help="Length of each synthesized line")
+    parser.add_argument("--footage-seconds", type=float, default=6)
+    parser.add_argument("--clips", type=int, default=8, help="Clips per footage folder")
+    parser.add_argument("--size", default="1280x720")
+    parser.add_argument("--fps", type=int, default=30)
+    parser.add_argument("--repeat-words", action="store_true", help="Reuse the same words, so the TTS cache hits")
+    parser.add_argument("--label", default=time.strftime("%Y%m%d-%H%M%S"))
+    parser.add_argument("--compare", help="Earlier results file to compare against")
+    parser.add_argument("--keep", action="store_true", help="Keep the synthetic project folder afterwards")
+    args = parser.parse_args()
+    if args.compare:
+        args.compare = os.path.abspath(args.compare)
+
+    sys.path.insert(0, MADLIBGEN_DIR)
+    project_dir = tempfile.mkdtemp(prefix="madlib_bench_")
+    os.chdir(project_dir) # main.py and api.py take their project folder from the working directory
+
+    import main
+    from bench.fake_tts import Fake_TTS_Server
+
+    video_types = [main.Nature_Doc(), main.Space_Doc(), main.Corporate_Intro()]
+    if args.types:
+        video_types = [video_type for video_type in video_types if video_type.video_code in args.types]
+
+    print("Building synthetic project in " + project_dir)
+    build_project(project_dir, video_types, main.SHOT_DIRECTORIES, args.clips, args.footage_seconds, args.size, args.fps)
+    server = Fake_TTS_Server(("127.0.0.1", 0), args.latency, build_voice_mp3(project_dir, args.voice_seconds))
+    server.start()
+    main.ELEVENLABS_URL = server.url
+    main.get_asset_catalog()
+
+    if args.mode == "api":
+        render = timed_by_type(lambda usercode, gen_args: render_api(main, usercode, gen_args))
+    else:
+        import api
+        client = api.app.test_client()
+        render = timed_by_type(lambda usercode, gen_args: render_http(client, usercode, gen_args))
+
+    cpu_before = cpu_seconds()
+    start = time.perf_counter()
+    latencies, errors = run_load(render, video_types, args.users, args.renders, args.repeat_words, main.API_CLEAN_USERCODE)
+    wall = time.perf_counter() - start
+    if args.mode == "http":
+        api.render_queue.pool.shutdown(wait=True) # Worker CPU time is only counted once they have exited
+        api.render_queue.manager.shutdown()
+    cpu = cpu_seconds() - cpu_before
+    server.shutdown()
+    if not args.keep:
+        shutil.rmtree(project_dir)
+
+    completed = sum(len(values) for values in latencies.values())
+    all_latencies = [value for values in latencies.values() for value in values]
+    results = {
+        "label": args.label,
+        "config": vars(args),
+        "backend": main.RENDER_BACKEND,
+        "types": dict({video_type.video_code: summarize(latencies.get(video_type.video_code, [])) for video_type in video_types},
+                      all=summarize(all_latencies)),
+        "errors": errors,
+        "wall_seconds": round(wall, 3),
+        "throughput_per_minute": round(completed / wall * 60, 3),
+        "cpu_seconds_per_render": round(cpu / completed, 3) if completed else None,
+        # Peak RSS of this process, and of the largest single child (ffmpeg or a render worker).
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "peak_child_rss_mb": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1),
+        "tts_requests": server.requests_served,
+    }
+
+    print(json.dumps(results, indent=2))
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    with open(os.path.join(RESULTS_DIR, args.label + ".json"), "w") as f:
+        json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f))
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,35 @@
+# Dry-runs the render planner, no audio or video is touched.
+#
+# Usage (from backend/Madlibgen): python -m bench.bench_planner --plans 20000
+
+import argparse
+import random
+import time
+
+import main
+from render_plan import build_render_plan, Render_Plan
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark render planning throughput.")
+    parser.add_argument("--plans", type=int, default=20000)
+    args = parser.parse_args()
+
+    catalog = main.get_asset_catalog()
+    rng = random.Random(0)
+    video_types = [main.Nature_Doc(), main.Space_Doc(), main.Corporate_Intro()]
+
+    for video_type in video_types:
+        start = time.perf_counter()
+        hashes = set()
+        for _ in range(args.plans):
+            durations = [rng.uniform(8, 20) for _ in range(4)]
+            plan = build_render_plan(video_type, durations, catalog, "bench.mp4", rng)
+        planned = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for _ in range(args.plans):
+            hashes.add(Render_Plan.from_json(plan.to_json()).plan_hash())
+        serialized = time.perf_counter() - start
+
+        print("%-16s plan %8.0f/s | JSON round trip + hash %8.0f/s" % (
+            video_type.video_code, args.plans / planned, args.plans / serialized))
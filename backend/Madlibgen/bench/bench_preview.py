@@ -0,0 +1,116 @@
+# Time to first video with preview renders: how long after POST /generate-video the preview tier can be fetched,
+# and how long until the full quality upgrade is done. Goes through the Flask routes and the render queue.
+#
+# Usage (from backend/Madlibgen):
+#   python -m bench.bench_preview --users 4 --renders 2 --preview-target 10 --full-target 60
+# Exits with 1 if the p95 of either tier misses its target. Results are written to bench/results/<label>.json.
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from bench.bench_e2e import MADLIBGEN_DIR, RESULTS_DIR, build_project, build_voice_mp3, run_load, summarize
+
+#Queues one render with a preview, returns the seconds until the preview and until the full video were fetched.
+def render_with_preview(client, usercode, gen_args):
+    start = time.perf_counter()
+    response = client.post("/generate-video", json={"user_id": usercode, "strings": gen_args, "preview": True})
+    if response.status_code != 202:
+        raise RuntimeError("POST /generate-video returned %d" % response.status_code)
+    job_id = response.get_json()["job_id"]
+
+    preview_seconds = None
+    while True:
+        status = client.get("/video-status/" + job_id).get_json()
+        if status["status"] == "failed":
+            raise RuntimeError(status["error"])
+        if preview_seconds is None and status["tier"] is not None:
+            response = client.get("/video-result/" + job_id + "?tier=preview")
+            if response.status_code != 200:
+                raise RuntimeError("GET /video-result?tier=preview returned %d" % response.status_code)
+            response.close()
+            preview_seconds = time.perf_counter() - start
+        if status["status"] == "done":
+            break
+        time.sleep(0.05)
+
+    response = client.get("/video-result/" + job_id)
+    if response.status_code != 200:
+        raise RuntimeError("GET /video-result returned %d" % response.status_code)
+    response.close()
+    return {"preview": preview_seconds, "full": time.perf_counter() - start}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark preview and full quality render latency.")
+    parser.add_argument("--types", nargs="+", help="Video types to render, defaults to all implemented types")
+    parser.add_argument("--users", type=int, default=2, help="Concurrent users")
+    parser.add_argument("--renders", type=int, default=2, help="Renders per user")
+    parser.add_argument("--latency", type=float, default=0.8, help="Stand-in TTS delay per request, in seconds")
+    parser.add_argument("--voice-seconds", type=float, default=8, help="Length of each synthesized line")
+    parser.add_argument("--footage-seconds", type=float, default=6)
+    parser.add_argument("--clips", type=int, default=8, help="Clips per footage folder")
+    parser.add_argument("--size", default="1280x720")
+    parser.add_argument("--fps", type=int, default=30)
+    parser.add_argument("--preview-target", type=float, default=10, help="p95 seconds until the preview is ready")
+    parser.add_argument("--full-target", type=float, default=60, help="p95 seconds until the full video is ready")
+    parser.add_argument("--label", default="preview-" + time.strftime("%Y%m%d-%H%M%S"))
+    parser.add_argument("--keep", action="store_true", help="Keep the synthetic project folder afterwards")
+    args = parser.parse_args()
+
+    sys.path.insert(0, MADLIBGEN_DIR)
+    project_dir = tempfile.mkdtemp(prefix="madlib_bench_")
+    os.chdir(project_dir) # main.py and api.py take their project folder from the working directory
+
+    import main
+    from bench.fake_tts import Fake_TTS_Server
+
+    video_types = [main.Nature_Doc(), main.Space_Doc(), main.Corporate_Intro()]
+    if args.types:
+        video_types = [video_type for video_type in video_types if video_type.video_code in args.types]
+
+    print("Building synthetic project in " + project_dir)
+    build_project(project_dir, video_types, main.SHOT_DIRECTORIES, args.clips, args.footage_seconds, args.size, args.fps)
+    server = Fake_TTS_Server(("127.0.0.1", 0), args.latency, build_voice_mp3(project_dir, args.voice_seconds))
+    server.start()
+    main.ELEVENLABS_URL = server.url
+    main.get_asset_catalog()
+
+    import api
+    client = api.app.test_client()
+
+    start = time.perf_counter()
+    render = lambda usercode, gen_args: render_with_preview(client, usercode, gen_args)
+    latencies, errors = run_load(render, video_types, args.users, args.renders, False, main.API_CLEAN_USERCODE)
+    wall = time.perf_counter() - start
+    api.render_queue.shutdown()
+    server.shutdown()
+    if not args.keep:
+        shutil.rmtree(project_dir)
+
+    targets = {"preview": args.preview_target, "full": args.full_target}
+    results = {
+        "label": args.label,
+        "config": vars(args),
+        "backend": main.RENDER_BACKEND,
+        "tiers": {tier: summarize(latencies.get(tier, [])) for tier in targets},
+        "errors": errors,
+        "wall_seconds": round(wall, 3),
+    }
+
+    print(json.dumps(results, indent=2))
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    with open(os.path.join(RESULTS_DIR, args.label + ".json"), "w") as f:
+        json.dump(results, f, indent=2)
+
+    missed = 0
+    for tier, target in targets.items():
+        summary = results["tiers"][tier]
+        met = summary is not None and summary["p95_seconds"] <= target
+        missed += not met
+        print("%-8s p95 %8s  target %6.1fs  %s" % (
+            tier, "-" if summary is None else "%.3fs" % summary["p95_seconds"], target, "ok" if met else "MISSED"))
+    sys.exit(1 if missed or errors else 0)
@@ -0,0 +1,62 @@
+# Measures how the segments backend scales with the number of shots encoded at once.
+#
+# Usage (from backend/Madlibgen): python -m bench.bench_segments --type nature_doc --workers 1 2 4 8 --runs 3
+# The single process ffmpeg backend is timed on the same plan as the reference. Every output is decoded once afterwards,
+# any decoder error (e.g. timestamps overlapping at a join) fails the run.
+
+import argparse
+import os
+import statistics
+import subprocess
+import time
+
+import numpy as np
+
+from bench.bench_backends import build_plan, soundtrack_path
+
+#Decodes a whole video and raises if ffmpeg reports anything at all.
+def check_decode(path):
+    from moviepy.config import get_setting
+    result = subprocess.run([get_setting("FFMPEG_BINARY"), "-v", "error", "-i", path, "-f", "null", "-"], capture_output=True)
+    errors = result.stderr.decode(errors="replace").strip()
+    if result.returncode != 0 or errors:
+        raise RuntimeError("%s does not decode cleanly: %s" % (path, errors))
+
+def time_render(render_function, plan, soundtrack, runs, **kwargs):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        render_function(plan, None, soundtrack, **kwargs)
+        timings.append(time.perf_counter() - start)
+        check_decode(plan.output.path)
+        os.remove(plan.output.path)
+    return statistics.median(timings)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark parallel segment encoding against worker count.")
+    parser.add_argument("--type", default="nature_doc", help="Video type to render")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, os.cpu_count() or 1])
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    usercode = "bench_segments"
+    plan_path = os.getcwd() + "/user_output/" + usercode + "_plan.json"
+    main = build_plan(args.type, usercode, plan_path)
+    import render
+    from render_plan import Render_Plan
+
+    try:
+        with open(plan_path) as f:
+            plan = Render_Plan.from_json(f.read())
+        soundtrack = np.load(soundtrack_path(plan_path))
+        print("%d shots, %.1fs of video, %d cores" % (len(plan.shots), plan.length, os.cpu_count() or 1))
+
+        reference = time_render(render.render_ffmpeg, plan, soundtrack, args.runs)
+        print("%-14s %7.2fs" % ("ffmpeg", reference))
+        for workers in sorted(set(args.workers)):
+            wall = time_render(render.render_segments, plan, soundtrack, args.runs, workers=workers)
+            print("%-14s %7.2fs  %.2fx" % ("segments x%d" % workers, wall, reference / wall))
+    finally:
+        main.API_CLEAN_USERCODE(usercode)
+        os.remove(plan_path)
+        os.remove(soundtrack_path(plan_path))
@@ -0,0 +1,26 @@
+# Measures how long compiling the script templates takes, and how many scripts per second each one renders.
+#
+# Usage (from backend/Madlibgen): python -m bench.bench_templates --renders 100000
+
+import argparse
+import time
+
+from script_template import load_templates
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark script template compiling and rendering.")
+    parser.add_argument("--renders", type=int, default=100000)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    templates = load_templates()
+    print("Loaded and compiled %d templates in %.2f ms" % (len(templates), (time.perf_counter() - start) * 1000))
+
+    for video_code, template in templates.items():
+        word_lists = [["word%d_%d" % (render, slot) for slot in range(len(template.prompts))] for render in range(100)]
+        start = time.perf_counter()
+        for render in range(args.renders):
+            template.render(word_lists[render % len(word_lists)])
+        wall = time.perf_counter() - start
+        print("%-16s %2d slots %10.0f scripts/s  %6.2f us/script" % (
+            video_code, len(template.prompts), args.renders / wall, wall / args.renders * 1e6))
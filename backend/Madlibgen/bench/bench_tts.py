@@ -0,0 +1,47 @@
+# Measures dialogue synthesis with one line at a time against all lines at once, using the stand-in TTS server.
+#
+# Usage (from backend/Madlibgen): python -m bench.bench_tts --latency 0.8 --runs 5
+
+import argparse
+import statistics
+import tempfile
+import time
+
+import main
+from bench.fake_tts import Fake_TTS_Server
+
+def time_synthesis(script, workers, runs):
+    main.TTS_WORKERS = workers
+    main._tts_session = None # Rebuild the connection pool at the new size
+    timings = []
+    for run in range(runs):
+        # Lines unique to the run, so every run pays for synthesis instead of hitting the TTS cache.
+        run_script = ["%s (%d, %d)" % (line, workers, run) for line in script]
+        start = time.perf_counter()
+        main.synthesize_dialogue(run_script, main.JACOB_ID)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark sequential against parallel TTS.")
+    parser.add_argument("--latency", type=float, default=0.8, help="Stand-in server delay per request")
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    server = Fake_TTS_Server(("127.0.0.1", 0), args.latency)
+    server.start()
+    main.ELEVENLABS_URL = server.url
+
+    # Same word for every slot is fine, only the number and length of the lines matter here.
+    doc = main.Nature_Doc()
+    script = doc.generate_script(doc.empty_array[:1] + ["word"] * (len(doc.empty_array) - 1))
+
+    with tempfile.TemporaryDirectory() as project_dir:
+        main.CURRENT_PROJECT_DIR = project_dir + "/"
+        for workers in (1, main.TTS_WORKERS):
+            timings = time_synthesis(script, workers, args.runs)
+            print("%d worker(s): median %.3fs, min %.3fs over %d lines" % (
+                workers, statistics.median(timings), min(timings), len(script)))
+
+    print("Peak concurrent requests seen by server: %d" % server.peak_in_flight)
+    server.shutdown()
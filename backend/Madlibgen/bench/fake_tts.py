@@ -0,0 +1,93 @@
+# A local stand-in for the ElevenLabs text to speech API, so renders can be benchmarked without network access.
+#
+# Usage: python -m bench.fake_tts --port 5050 --latency 0.8
+# Then run the backend with ELEVENLABS_URL=http://127.0.0.1:5050
+
+import argparse
+import json
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Silent MPEG-1 Layer III frame: 128kbps, 44.1kHz, mono. An all zero body decodes as silence.
+MP3_FRAME_HEADER = bytes([0xFF, 0xFB, 0x90, 0xC4])
+MP3_FRAME_SIZE = 417
+MP3_FRAME_SECONDS = 1152 / 44100
+
+# Roughly how fast the narrators speak.
+CHARACTERS_PER_SECOND = 15
+
+#Builds a silent MP3 of about the given length.
+def silent_mp3(seconds):
+    frame = MP3_FRAME_HEADER + bytes(MP3_FRAME_SIZE - len(MP3_FRAME_HEADER))
+    return frame * max(1, round(seconds / MP3_FRAME_SECONDS))
+
+class Fake_TTS_Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    #latency is the delay before the first byte, mp3 (optional) is returned instead of generated silence.
+    def __init__(self, address, latency=0.0, mp3=None):
+        super().__init__(address, Fake_TTS_Handler)
+        self.latency = latency
+        self.mp3 = mp3
+        self.requests_served = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return "http://%s:%d" % self.server_address[:2]
+
+    #Serves from a background thread, returns the thread.
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+class Fake_TTS_Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" # Keep-alive, like the real API
+
+    def do_POST(self):
+        server = self.server
+        with server.lock:
+            server.in_flight += 1
+            server.peak_in_flight = max(server.peak_in_flight, server.in_flight)
+
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            if not self.path.startswith("/v1/text-to-speech/") or "text" not in body:
+                self.send_error(400)
+                return
+
+            time.sleep(server.latency)
+            audio = server.mp3 or silent_mp3(len(body["text"]) / CHARACTERS_PER_SECOND)
+            self.send_response(200)
+            self.send_header("Content-Type", "audio/mpeg")
+            self.send_header("Content-Length", str(len(audio)))
+            self.end_headers()
+            self.wfile.write(audio)
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+                server.requests_served += 1
+
+    def log_message(self, format, *args):
+        pass # Keep benchmark output readable
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stand-in ElevenLabs text to speech server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5050)
+    parser.add_argument("--latency", type=float, default=0.8, help="Seconds before each response")
+    parser.add_argument("--mp3", help="Serve this file instead of generated silence")
+    args = parser.parse_args()
+
+    mp3 = None
+    if args.mp3:
+        with open(args.mp3, "rb") as f:
+            mp3 = f.read()
+
+    server = Fake_TTS_Server((args.host, args.port), args.latency, mp3)
+    print("Fake TTS server listening on " + server.url)
+    server.serve_forever()
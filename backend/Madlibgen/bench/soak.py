@@ -0,0 +1,107 @@
+# Soak test: hundreds of renders in this process, watching for leaked memory, file handles and ffmpeg processes.
+#
+# Usage (from backend/Madlibgen):
+#   python -m bench.soak --renders 300 --backend moviepy
+#
+# Every --sample renders, VmRSS, the open file descriptor count and the number of live child processes are read
+# from /proc. After a warm-up, RSS and FDs should stay flat and no child should outlive its render. Exits 1 if
+# RSS grew by more than --max-rss-growth-mb or the FD count grew at all. Linux only.
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from bench.bench_e2e import MADLIBGEN_DIR, RESULTS_DIR, build_project, build_voice_mp3, words_for
+
+#Resident memory of this process, in MB.
+def rss_mb():
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+def open_fds():
+    return len(os.listdir("/proc/self/fd"))
+
+def live_children():
+    pid = os.getpid()
+    with open("/proc/%d/task/%d/children" % (pid, pid)) as f:
+        return len(f.read().split())
+
+def sample(render_count, start):
+    return {"renders": render_count, "seconds": round(time.perf_counter() - start, 1),
+            "rss_mb": round(rss_mb(), 1), "fds": open_fds(), "children": live_children()}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render soak test.")
+    parser.add_argument("--renders", type=int, default=300)
+    parser.add_argument("--backend", default=None, help="Render backend, defaults to MADLIB_RENDER_BACKEND")
+    parser.add_argument("--sample", type=int, default=10, help="Renders between samples")
+    parser.add_argument("--warmup", type=int, default=20, help="Renders before the baseline sample")
+    parser.add_argument("--max-rss-growth-mb", type=float, default=50)
+    parser.add_argument("--voice-seconds", type=float, default=2)
+    parser.add_argument("--footage-seconds", type=float, default=2)
+    parser.add_argument("--size", default="320x180")
+    parser.add_argument("--fps", type=int, default=15)
+    parser.add_argument("--label", default="soak-" + time.strftime("%Y%m%d-%H%M%S"))
+    args = parser.parse_args()
+
+    sys.path.insert(0, MADLIBGEN_DIR)
+    project_dir = tempfile.mkdtemp(prefix="madlib_soak_")
+    os.chdir(project_dir) # main.py takes its project folder from the working directory
+
+    import main
+    from bench.fake_tts import Fake_TTS_Server
+
+    if args.backend:
+        main.RENDER_BACKEND = args.backend
+    video_types = [main.Space_Doc(), main.Corporate_Intro()]
+    build_project(project_dir, video_types, main.SHOT_DIRECTORIES, 3, args.footage_seconds, args.size, args.fps)
+    server = Fake_TTS_Server(("127.0.0.1", 0), 0.0, build_voice_mp3(project_dir, args.voice_seconds))
+    server.start()
+    main.ELEVENLABS_URL = server.url
+    main.get_asset_catalog()
+
+    samples = []
+    errors = []
+    start = time.perf_counter()
+    for render_index in range(args.renders):
+        video_type = video_types[render_index % len(video_types)]
+        usercode = "soak_%d" % render_index
+        try:
+            if not main.API_CREATE_VIDEO(usercode, words_for(video_type, render_index, True)):
+                errors.append(usercode + ": API_CREATE_VIDEO returned False")
+        except Exception as e:
+            errors.append(usercode + ": " + str(e))
+        main.API_CLEAN_USERCODE(usercode)
+        if (render_index + 1) % args.sample == 0:
+            samples.append(sample(render_index + 1, start))
+            print(json.dumps(samples[-1]))
+
+    server.shutdown()
+    shutil.rmtree(project_dir)
+
+    baseline = next((entry for entry in samples if entry["renders"] >= args.warmup), samples[0])
+    final = samples[-1]
+    results = {
+        "label": args.label,
+        "config": vars(args),
+        "backend": main.RENDER_BACKEND,
+        "errors": errors,
+        "samples": samples,
+        "rss_growth_mb": round(final["rss_mb"] - baseline["rss_mb"], 1),
+        "fd_growth": final["fds"] - baseline["fds"],
+        "max_children": max(entry["children"] for entry in samples),
+    }
+    print(json.dumps({key: value for key, value in results.items() if key != "samples"}, indent=2))
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    with open(os.path.join(RESULTS_DIR, args.label + ".json"), "w") as f:
+        json.dump(results, f, indent=2)
+
+    leaked = results["rss_growth_mb"] > args.max_rss_growth_mb or results["fd_growth"] > 0
+    sys.exit(1 if leaked or errors else 0)
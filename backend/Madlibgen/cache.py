@@ -0,0 +1,138 @@
+# Standard python imports
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import threading
+
+#Hashes any JSON friendly value into a stable cache key.
+def cache_key(value):
+    return hashlib.sha256(json.dumps(value, sort_keys=True, separators=(",", ":")).encode("utf-8")).hexdigest()
+
+#Puts a file at dest without copying its bytes when possible: hard link first, then symlink, then a plain copy.
+#Does nothing if dest already is source, removing it first would delete the only copy.
+def link_file(source, dest):
+    if os.path.exists(dest) and os.path.samefile(source, dest):
+        return
+    if os.path.lexists(dest):
+        os.remove(dest)
+    try:
+        os.link(source, dest)
+        return
+    except FileNotFoundError:
+        raise
+    except OSError:
+        pass # Different filesystem or no hard link support
+    try:
+        os.symlink(os.path.abspath(source), dest)
+        return
+    except OSError:
+        pass
+    shutil.copyfile(source, dest)
+
+#A directory of files addressed by key, capped in size and evicting the least recently used files first.
+#The cache keeps no index of its own, so several render processes can safely share one directory.
+class File_Cache:
+    def __init__(self, directory, max_bytes, suffix=""):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.directory, key + self.suffix)
+
+    #Returns the path of a cached file and marks it as recently used, or None on a miss.
+    def get(self, key):
+        path = self.path(key)
+        try:
+            os.utime(path) # Last use is tracked through the modification time
+        except FileNotFoundError:
+            with self.lock:
+                self.misses += 1
+            return None
+        with self.lock:
+            self.hits += 1
+        return path
+
+    #Stores an iterable of byte chunks under key and returns its path. Readers never see a half written file.
+    def put(self, key, chunks):
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in chunks:
+                    if chunk:
+                        f.write(chunk)
+            os.replace(temp_path, self.path(key))
+        except BaseException:
+            os.remove(temp_path)
+            raise
+        self.evict(keep=key)
+        return self.path(key)
+
+    #Stores an existing file under key (hard linked when possible) and returns its path.
+    def put_file(self, key, source):
+        temp_path = os.path.join(self.directory, "%s.%d.%d.part" % (key, os.getpid(), threading.get_ident()))
+        try:
+            try:
+                os.link(source, temp_path)
+            except FileNotFoundError:
+                raise
+            except OSError:
+                shutil.copyfile(source, temp_path) # A symlink would dangle once the source is cleaned up
+            os.replace(temp_path, self.path(key))
+        except BaseException:
+            if os.path.lexists(temp_path):
+                os.remove(temp_path)
+            raise
+        self.evict(keep=key)
+        return self.path(key)
+
+    def _entries(self):
+        entries = []
+        with os.scandir(self.directory) as items:
+            for item in items:
+                if item.is_file() and item.name.endswith(self.suffix) and not item.name.endswith(".part"):
+                    try:
+                        stat = item.stat()
+                    except FileNotFoundError:
+                        continue # Evicted by another process while we looked
+                    entries.append((stat.st_mtime, stat.st_size, item.path))
+        return entries
+
+    #Deletes the least recently used files until the cache fits in max_bytes.
+    def evict(self, keep=None):
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        keep_path = None if keep is None else self.path(keep)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            if path == keep_path:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            with self.lock:
+                self.evictions += 1
+
+    #Hits, misses and evictions seen by this process. Cheap, unlike stats which lists the directory.
+    def counters(self):
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+    def stats(self):
+        entries = self._entries()
+        return dict(
+            self.counters(),
+            entries=len(entries),
+            bytes=sum(size for _, size, _ in entries),
+            max_bytes=self.max_bytes,
+        )
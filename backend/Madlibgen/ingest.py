@@ -0,0 +1,124 @@
+# Transcodes every footage file once into one uniform format, so renders never have to reconcile codecs,
+# resolutions or frame rates and shots can be joined without re-encoding.
+#
+# Usage (from backend/Madlibgen): python ingest.py [--force] [--workers N]
+# Normalized copies live under cache/footage/<settings>/ and are picked up by the asset catalog automatically.
+
+# Standard python imports
+import os
+import json
+import hashlib
+import argparse
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+# Moviepy module imports
+from moviepy.config import get_setting
+
+# Normalized footage settings. Changing any of them starts a fresh cache folder.
+NORMALIZED_WIDTH = 1920
+NORMALIZED_HEIGHT = 1080
+NORMALIZED_FPS = 30
+GOP_SECONDS = 1 # A keyframe every second, so cut points on whole seconds never need a re-encode
+PIXEL_FORMAT = "yuv420p"
+VIDEO_CODEC = "libx264"
+PRESET = "medium"
+CRF = 18
+B_FRAMES = 0 # Decode order is display order, so a cut on a keyframe holds exactly its frames and timestamps start at 0
+
+# Files transcoded at once. ffmpeg already spreads one encode over several cores.
+INGEST_WORKERS = 2
+
+def normalized_settings():
+    return {
+        "width": NORMALIZED_WIDTH,
+        "height": NORMALIZED_HEIGHT,
+        "fps": NORMALIZED_FPS,
+        "gop": NORMALIZED_FPS * GOP_SECONDS,
+        "pix_fmt": PIXEL_FORMAT,
+        "codec": VIDEO_CODEC,
+        "preset": PRESET,
+        "crf": CRF,
+        "bframes": B_FRAMES,
+    }
+
+def normalized_folder(project_dir):
+    settings_hash = hashlib.sha256(json.dumps(normalized_settings(), sort_keys=True).encode("utf-8")).hexdigest()[:12]
+    return project_dir + "cache/footage/" + settings_hash + "/"
+
+#Where the normalized copy of footage/<type>/<shots>/<name> lives.
+def normalized_path(project_dir, source_path):
+    relative = os.path.relpath(source_path, project_dir + "footage/")
+    return normalized_folder(project_dir) + os.path.splitext(relative)[0] + ".mp4"
+
+#Encoder arguments of normalized footage. Renders that re-encode some shots and copy the rest use the same ones,
+#so every piece carries identical stream parameters and they can be joined as is.
+def encoder_params():
+    settings = normalized_settings()
+    return [
+        "-c:v", settings["codec"], "-pix_fmt", settings["pix_fmt"],
+        "-preset", settings["preset"], "-crf", str(settings["crf"]), "-bf", str(settings["bframes"]),
+        "-g", str(settings["gop"]), "-keyint_min", str(settings["gop"]), "-sc_threshold", "0",
+        "-force_key_frames", "expr:gte(t,n_forced*%d)" % GOP_SECONDS,
+    ]
+
+#True when output settings (see render_plan.py) describe the normalized format, so normalized shots can be copied into it.
+def matches_normalized(output):
+    return (list(output.size) == [NORMALIZED_WIDTH, NORMALIZED_HEIGHT] and output.fps == NORMALIZED_FPS
+            and output.video_codec == VIDEO_CODEC and output.pixel_format == PIXEL_FORMAT and output.preset is None)
+
+#True when t (seconds into a normalized file) falls on one of its keyframes.
+def on_keyframe(t):
+    return abs(t / GOP_SECONDS - round(t / GOP_SECONDS)) < 1e-6
+
+def transcode_command(source_path, output_path):
+    settings = normalized_settings()
+    video_filter = (
+        "scale={width}:{height}:force_original_aspect_ratio=decrease,"
+        "pad={width}:{height}:(ow-iw)/2:(oh-ih)/2,setsar=1,fps={fps},format={pix_fmt}"
+    ).format(**settings)
+    return [
+        get_setting("FFMPEG_BINARY"), "-y", "-loglevel", "error",
+        "-i", source_path,
+        "-vf", video_filter,
+        *encoder_params(),
+        "-an", # Footage audio is always replaced by the narration mix
+        "-movflags", "+faststart",
+        output_path
+    ]
+
+def is_up_to_date(source_path, output_path):
+    return os.path.exists(output_path) and os.path.getmtime(output_path) >= os.path.getmtime(source_path)
+
+#Transcodes one file if its normalized copy is missing or stale. Returns True if work was done.
+def normalize_file(project_dir, source_path, force=False):
+    output_path = normalized_path(project_dir, source_path)
+    if not force and is_up_to_date(source_path, output_path):
+        return False
+
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    temp_path = output_path + ".part.mp4"
+    subprocess.run(transcode_command(source_path, temp_path), check=True)
+    os.replace(temp_path, output_path) # The catalog never sees half written copies
+    return True
+
+def footage_files(project_dir):
+    for root, _, files in os.walk(project_dir + "footage/"):
+        for name in sorted(files):
+            yield os.path.join(root, name)
+
+#Normalizes the whole footage folder, several files at a time.
+def normalize_footage(project_dir, workers=None, force=False):
+    sources = list(footage_files(project_dir))
+    with ThreadPoolExecutor(max_workers=workers or INGEST_WORKERS) as pool:
+        results = pool.map(lambda source: normalize_file(project_dir, source, force), sources)
+        for source, transcoded in zip(sources, results):
+            print(("Normalized: " if transcoded else "Up to date: ") + source)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Transcode footage into the uniform render format.")
+    parser.add_argument("--force", action="store_true", help="Transcode files that are already up to date")
+    parser.add_argument("--workers", type=int, default=INGEST_WORKERS, help="Files transcoded at once")
+    args = parser.parse_args()
+
+    normalize_footage(os.getcwd() + "/", args.workers, args.force)
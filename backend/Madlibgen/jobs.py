@@ -0,0 +1,340 @@
+# Standard python imports
+import os
+import uuid
+import threading
+import multiprocessing
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, Future
+from concurrent.futures.process import BrokenProcessPool
+
+from main import API_CREATE_VIDEO, API_ESTIMATE_RENDER, user_video_path, user_preview_path, render_seed, video_cache_key, get_file_caches
+from cache import link_file
+from timing import METRICS, timeline, span
+
+# Number of render processes running at once, defaults to one per core.
+RENDER_WORKERS = int(os.environ.get("MADLIB_RENDER_WORKERS", os.cpu_count() or 1))
+
+# Budget shared by all running renders. A render only starts once its estimated cost (see estimate_render_cost in
+# render.py) fits next to the renders already running. One that is larger than the whole budget runs on its own.
+RENDER_MEMORY_BUDGET = int(os.environ.get("MADLIB_RENDER_MEMORY_MB", 4096)) * 1024 * 1024
+RENDER_HANDLE_BUDGET = int(os.environ.get("MADLIB_RENDER_HANDLES", 512))
+
+# Finished jobs we keep track of before forgetting the oldest ones.
+MAX_FINISHED_JOBS = 256
+
+# Job states:
+JOB_QUEUED = "queued"
+JOB_RENDERING = "rendering"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+# Video tiers a job can have ready:
+TIER_PREVIEW = "preview" # Low resolution, rendered first when asked for
+TIER_FULL = "full"
+
+### WORKER SIDE ###
+
+#Runs inside a render process. Progress is written into a dict shared with the web server so it can be polled.
+#previews (a shared dict, optional) asks for a preview first, the job ID is added to it once the preview is written.
+def _render_job(job_id, usercode, gen_args, progress, deterministic=False, seed=None, previews=None):
+    # A previous video under this usercode must not be streamed as if it were this one.
+    for path in (user_video_path(usercode), user_preview_path(usercode)):
+        if os.path.exists(path):
+            os.remove(path)
+    progress[job_id] = 0.0 # Marks the job as picked up by a worker, only once the old files are gone
+
+    def report(fraction):
+        progress[job_id] = round(fraction, 3)
+
+    def preview_ready(path):
+        previews[job_id] = True
+
+    # Exceptions are caught here so the timing spans make it back to the server either way.
+    result = {"ok": False, "error": None}
+    # Cache counters live in this process, only what changed during the render is sent back.
+    caches = get_file_caches()
+    counters = {name: cache.counters() for name, cache in caches.items()}
+    with timeline() as current:
+        try:
+            with span("render"):
+                result["ok"] = API_CREATE_VIDEO(usercode, gen_args, report, deterministic, seed, previews is not None, preview_ready)
+            if not result["ok"]:
+                result["error"] = "Video Generation failed"
+        except Exception as e:
+            result["error"] = str(e)
+    result["spans"] = current.spans
+    result["caches"] = {
+        name: {counter: value - counters[name][counter] for counter, value in cache.counters().items()}
+        for name, cache in caches.items()
+    }
+    return result
+
+### SERVER SIDE ###
+
+#Memory and file handles reserved by the renders that are running. Not thread safe, Render_Queue holds its lock.
+class Render_Budget:
+    def __init__(self, max_bytes=RENDER_MEMORY_BUDGET, max_handles=RENDER_HANDLE_BUDGET):
+        self.max_bytes = max_bytes
+        self.max_handles = max_handles
+        self.bytes = 0
+        self.handles = 0
+        self.running = 0
+
+    #Reserves a render's cost if it fits, or if nothing else is running so oversized renders still get their turn.
+    def try_acquire(self, cost):
+        fits = self.bytes + cost["bytes"] <= self.max_bytes and self.handles + cost["handles"] <= self.max_handles
+        if not fits and self.running:
+            return False
+        self.bytes += cost["bytes"]
+        self.handles += cost["handles"]
+        self.running += 1
+        return True
+
+    def release(self, cost):
+        self.bytes -= cost["bytes"]
+        self.handles -= cost["handles"]
+        self.running -= 1
+
+    def snapshot(self):
+        return {
+            "running": self.running,
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "handles": self.handles,
+            "max_handles": self.max_handles,
+        }
+
+class Render_Queue:
+    def __init__(self, max_workers=RENDER_WORKERS, budget=None):
+        self.manager = multiprocessing.Manager()
+        self.progress = self.manager.dict()
+        self.previews = self.manager.dict() # job_id -> True once the job's preview is written
+        self.max_workers = max_workers
+        self.pool = ProcessPoolExecutor(max_workers=max_workers)
+        self.budget = budget or Render_Budget()
+        self.pending = deque() # (job_id, worker args) of renders waiting for budget, first come first served
+        self.jobs = OrderedDict() # job_id -> job record, in submission order
+        self.in_flight = {} # video cache key -> job_id of the deterministic render producing it
+        self.lock = threading.RLock() # Reentrant, a done callback can run inside _dispatch
+
+    #Queues a render and returns its job ID straight away. Deterministic submissions identical to one that is
+    #still queued or rendering share its render instead of starting another. preview=True renders a preview
+    #tier first, see TIER_PREVIEW.
+    def submit(self, usercode, gen_args, deterministic=False, seed=None, preview=False):
+        job_id = uuid.uuid4().hex
+        key = None
+        if deterministic:
+            seed = render_seed(gen_args, seed)
+            key = video_cache_key(gen_args, seed)
+        cost = API_ESTIMATE_RENDER(gen_args)
+
+        with self.lock:
+            primary_id = self.in_flight.get(key)
+            if primary_id is not None:
+                future = self.jobs[primary_id]["future"]
+                render_usercode = self.jobs[primary_id]["usercode"]
+            else:
+                primary_id = job_id
+                render_usercode = usercode
+                #Stands in for the worker's future until the render is admitted, see _dispatch.
+                future = Future()
+                previews = self.previews if preview else None
+                self.pending.append((job_id, (job_id, usercode, gen_args, self.progress, deterministic, seed, previews)))
+                if key is not None:
+                    self.in_flight[key] = job_id
+            self.jobs[job_id] = {
+                "usercode": usercode,
+                "future": future,
+                "primary_id": primary_id, # Whose render this job waits on, itself unless coalesced
+                "render_usercode": render_usercode, # Where that render writes its video
+                "key": key,
+                "cost": cost,
+                "error": None,
+            }
+            self._forget_finished_jobs()
+            self._dispatch()
+        future.add_done_callback(lambda f: self._on_finished(job_id, f))
+        return job_id
+
+    #Hands waiting renders to the pool, in order, for as long as the budget allows. Called with the lock held.
+    def _dispatch(self):
+        while self.pending:
+            job_id, args = self.pending[0]
+            if not self.budget.try_acquire(self.jobs[job_id]["cost"]):
+                return
+            self.pending.popleft()
+            if not self.jobs[job_id]["future"].set_running_or_notify_cancel():
+                self.budget.release(self.jobs[job_id]["cost"])
+                continue
+            try:
+                worker_future = self._submit_render(args)
+            except Exception as e:
+                # Never started, so nothing else will give its budget back or finish its future.
+                self.budget.release(self.jobs[job_id]["cost"])
+                self.jobs[job_id]["future"].set_exception(e)
+                continue
+            worker_future.add_done_callback(lambda f, job_id=job_id, pool=self.pool: self._on_render_done(job_id, f, pool))
+
+    #Hands a render to the pool. A pool whose worker died refuses new work, it is replaced and asked once more.
+    def _submit_render(self, args):
+        try:
+            return self.pool.submit(_render_job, *args)
+        except BrokenProcessPool:
+            self._replace_pool(self.pool)
+            return self.pool.submit(_render_job, *args)
+
+    #Swaps a broken pool for a fresh one, unless that already happened. Called with the lock held.
+    def _replace_pool(self, broken_pool):
+        if self.pool is not broken_pool:
+            return
+        print("Render worker died, starting a new pool")
+        self.pool = ProcessPoolExecutor(max_workers=self.max_workers)
+        broken_pool.shutdown(wait=False)
+
+    #Gives the budget back, starts whatever now fits, then completes the job's own future. A worker that was killed
+    #(out of memory, crash) fails every render of its pool, which is then replaced so later jobs still run.
+    def _on_render_done(self, job_id, worker_future, pool):
+        with self.lock:
+            job = self.jobs[job_id]
+            self.budget.release(job["cost"])
+            if not worker_future.cancelled() and isinstance(worker_future.exception(), BrokenProcessPool):
+                self._replace_pool(pool)
+            self._dispatch()
+        if worker_future.exception() is not None:
+            job["future"].set_exception(worker_future.exception())
+        else:
+            job["future"].set_result(worker_future.result())
+
+    def _on_finished(self, job_id, future):
+        with self.lock:
+            job = self.jobs.get(job_id)
+        if job is None:
+            return
+        primary = job["primary_id"] == job_id
+
+        error = None
+        if future.cancelled():
+            error = "Render cancelled" # Still waiting for budget when the queue shut down
+        elif future.exception() is not None:
+            error = str(future.exception()) # The worker process itself died
+        elif future.result()["error"] is not None:
+            error = future.result()["error"]
+        elif not primary and job["usercode"] != job["render_usercode"]:
+            # Coalesced job: the video was rendered under the primary's usercode, give this user a link to it.
+            try:
+                os.makedirs(os.path.dirname(user_video_path(job["usercode"])), exist_ok=True)
+                link_file(user_video_path(job["render_usercode"]), user_video_path(job["usercode"]))
+            except OSError as e:
+                error = "Video Generation failed: " + str(e)
+
+        with self.lock:
+            job["error"] = error
+            job["finished"] = True
+            if primary and self.in_flight.get(job["key"]) == job_id:
+                del self.in_flight[job["key"]]
+        if primary and not future.cancelled():
+            self.progress.pop(job_id, None)
+            if future.exception() is None:
+                result = future.result()
+                METRICS.observe_render(result["spans"], result["caches"], job_id=job_id, ok=result["ok"])
+
+    def _forget_finished_jobs(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job["future"].done()]
+        for job_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self.jobs[job_id]
+            self.previews.pop(job_id, None)
+
+    def _state(self, job_id, job):
+        if job["future"].done():
+            if not job.get("finished"):
+                return JOB_RENDERING # Finished, but its done callback has not run yet
+            if job["error"] is None:
+                return JOB_DONE
+            return JOB_FAILED
+        if job["primary_id"] in self.progress:
+            return JOB_RENDERING
+        return JOB_QUEUED
+
+    #Best video the job has ready: TIER_FULL, TIER_PREVIEW or None.
+    def _tier(self, job, state):
+        if state == JOB_DONE:
+            return TIER_FULL
+        if state != JOB_FAILED and job["primary_id"] in self.previews:
+            return TIER_PREVIEW
+        return None
+
+    #Returns a JSON friendly description of a job, or None if the job is unknown.
+    def status(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return None
+
+            state = self._state(job_id, job)
+            status = {
+                "job_id": job_id,
+                "status": state,
+                "progress": 1.0 if state == JOB_DONE else self.progress.get(job["primary_id"], 0.0),
+                "queue_position": None,
+                "tier": self._tier(job, state),
+            }
+
+            # Position counts the queued renders submitted before this one, so 0 means next in line.
+            if state == JOB_QUEUED:
+                position = 0
+                for other_id, other in self.jobs.items():
+                    if other_id == job["primary_id"]:
+                        break
+                    if other["primary_id"] == other_id and self._state(other_id, other) == JOB_QUEUED:
+                        position += 1
+                status["queue_position"] = position
+            if state == JOB_FAILED:
+                status["error"] = job["error"] or "Video Generation failed"
+            return status
+
+    #Returns where the job's MP4 is (or is being) written, whether or not it has started. None if the job is unknown.
+    #Coalesced jobs point at the shared render until their own copy is linked in.
+    def output_path(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+        if job is None:
+            return None
+        if job.get("finished") and job["error"] is None:
+            return user_video_path(job["usercode"])
+        return user_video_path(job["render_usercode"])
+
+    #Returns the path of the finished MP4, or None if the job has not finished successfully.
+    def result_path(self, job_id):
+        status = self.status(job_id)
+        if status is None or status["status"] != JOB_DONE:
+            return None
+        return self.output_path(job_id)
+
+    #Memory and handles reserved by running renders, and how many renders wait for them.
+    def budget_status(self):
+        with self.lock:
+            return dict(self.budget.snapshot(), waiting=len(self.pending))
+
+    #Returns the path of the job's preview, or None if it has none (yet). Stays available once the full video is done.
+    def preview_path(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None or job.get("error") is not None or job["primary_id"] not in self.previews:
+                return None
+        return user_preview_path(job["render_usercode"])
+
+    #Number of known jobs in each state.
+    def counts(self):
+        with self.lock:
+            counts = {JOB_QUEUED: 0, JOB_RENDERING: 0, JOB_DONE: 0, JOB_FAILED: 0}
+            for job_id, job in self.jobs.items():
+                counts[self._state(job_id, job)] += 1
+            return counts
+
+    def shutdown(self):
+        with self.lock:
+            while self.pending:
+                job_id, args = self.pending.popleft()
+                self.jobs[job_id]["future"].cancel()
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        self.manager.shutdown()
@@ -3,15 +3,27 @@
 import random
 import requests
 import os
-
-# Moviepy module imports
-from moviepy.editor import VideoFileClip, AudioFileClip, CompositeAudioClip, CompositeVideoClip
-from moviepy.editor import concatenate_videoclips
-from moviepy.video import vfx
+import threading
+import time
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 # Other important imports...
-from api_key import API_KEY_EL # If you are recreating this with your own key youll need to change this.
+try:
+    from api_key import API_KEY_EL # If you are recreating this with your own key youll need to change this.
+except ImportError:
+    API_KEY_EL = os.environ.get("ELEVENLABS_API_KEY", "")
 from enum import Enum
+from cache import File_Cache, cache_key, link_file
+from assets import Asset_Catalog
+from audio import Music_Beds, decode_mp3, mix_soundtrack
+from mp3 import Mp3_Duration, mp3_duration
+from render import execute_plan, estimate_render_cost
+from render_plan import build_render_plan, DEFAULT_SIZE, MUSIC_GAIN
+from script_template import load_templates
+from timing import span, record_span
 
 
 # Used for debugging, should be set to TRUE in production.
@@ -25,15 +37,54 @@ MORGAN_ID = "gA2wIcrJlZEsmvP dM8LX"
 JOSH_ID = "jhNeib73TDYhp5mcurDs"
 SALLY_ID = "HRqKb4rPQVQVN5wYZtZP"
 
+# Voice names script templates can use.
+VOICES = {
+    "JACOB": JACOB_ID,
+    "MORGAN": MORGAN_ID,
+    "JOSH": JOSH_ID,
+    "SALLY": SALLY_ID
+}
+
+# Text to speech settings, the URL can be pointed at a local stand-in server for benchmarks.
+ELEVENLABS_URL = os.environ.get("ELEVENLABS_URL", "https://api.elevenlabs.io")
+TTS_WORKERS = 4 # Lines synthesized at the same time
+TTS_TIMEOUT = (5, 60) # Seconds to connect, seconds between bytes
+TTS_RETRIES = 3
+TTS_BACKOFF = 0.5 # Retries wait 0.5s, 1s, 2s...
+TTS_CACHE_MAX_BYTES = 512 * 1024 * 1024 # Synthesized lines kept on disk under cache/tts/
+
 #Defines the number of starting indeces that should be elapsed when creating scripts.
 WORD_INPUT_SKIP = 1
 DOC_TYPE_INDEX = 0
 
+# Render settings.
+RENDER_BACKEND = os.environ.get("MADLIB_RENDER_BACKEND", "ffmpeg") # "ffmpeg", "segments" or "moviepy", moviepy is the fallback
+
+# Finished videos of deterministic renders, kept under cache/videos/. Bump the version to invalidate them all,
+# e.g. after changing footage, music or voices.
+VIDEO_CACHE_MAX_BYTES = 2 * 1024 * 1024 * 1024
+VIDEO_CACHE_VERSION = 1
+
+#Roughly how fast the narrators speak, used to guess how much dialogue audio a render will hold in memory.
+SPEECH_CHARACTERS_PER_SECOND = 15
+
+#Share of the reported render progress taken up by dialogue synthesis, the rest belongs to the encode.
+VOICE_PROGRESS_SHARE = 0.3
+#Share of the encode progress taken up by the preview, when one is rendered.
+PREVIEW_PROGRESS_SHARE = 0.15
+
 # Shot types:
 EST_SHOT = "est"
 REG_SHOT = "reg"
 SPE_SHOT = "spe"
 
+# Folder each shot type lives in, under footage/<video type>/
+SHOT_DIRECTORIES = {
+    EST_SHOT: "establishing_shots",
+    REG_SHOT: "regular_shots",
+    SPE_SHOT: "special_shots"
+}
+
 # Documentary Types:
 class VideoTypeEnum(Enum):
     NATURE_DOC = "nature_doc"
@@ -41,6 +92,10 @@ class VideoTypeEnum(Enum):
     HISTORY_CHANNEL = "history_channel"
     CORPORATE_INTRO = "corporate_intro"
 
+# Every doc type's script, compiled once. Templates for types without a class below (e.g. history_channel) are
+# picked up from scripts/ too.
+SCRIPT_TEMPLATES = load_templates()
+
 ### FILE IO ###
 
 #This function clears out a certain directory.
@@ -80,12 +135,108 @@ def get_files_in_directory(directory_path):
         print(f"Error: {e}")
         return None
 
+_asset_catalog = None
+
+#Returns the index of footage and music, building it on first use and refreshing it when the files change.
+def get_asset_catalog():
+    global _asset_catalog
+    if _asset_catalog is None:
+        #Indexed by script template, so a doc type added as a scripts/*.json file gets its footage without code changes.
+        _asset_catalog = Asset_Catalog(CURRENT_PROJECT_DIR, list(SCRIPT_TEMPLATES), SHOT_DIRECTORIES)
+    else:
+        _asset_catalog.refresh_if_changed()
+    return _asset_catalog
+
 ### VIDEO AND AUDIO GENERATION ###
 
+_tts_session = None
+_tts_session_pid = None
+_tts_session_lock = threading.Lock()
+
+#Returns the keep-alive session shared by all TTS requests of this process. Forked render workers get their own.
+def get_tts_session():
+    global _tts_session, _tts_session_pid
+    with _tts_session_lock:
+        if _tts_session is None or _tts_session_pid != os.getpid():
+            retry = Retry(
+                total=TTS_RETRIES,
+                backoff_factor=TTS_BACKOFF,
+                status_forcelist=(429, 500, 502, 503, 504),
+                allowed_methods=frozenset(["POST"])
+            )
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=TTS_WORKERS, max_retries=retry)
+            _tts_session = requests.Session()
+            _tts_session.mount("http://", adapter)
+            _tts_session.mount("https://", adapter)
+            _tts_session_pid = os.getpid()
+        return _tts_session
+
+_tts_cache = None
+
+#Returns the on-disk cache of synthesized lines, shared by every render process.
+def get_tts_cache():
+    global _tts_cache
+    if _tts_cache is None:
+        _tts_cache = File_Cache(CURRENT_PROJECT_DIR + "cache/tts/", TTS_CACHE_MAX_BYTES, ".mp3")
+    return _tts_cache
+
+_music_beds = None
+
+#Returns the decoded, attenuated music tracks, kept under cache/music/ and shared by every render process.
+def get_music_beds():
+    global _music_beds
+    if _music_beds is None:
+        _music_beds = Music_Beds(CURRENT_PROJECT_DIR + "cache/music/")
+    return _music_beds
+
+_video_cache = None
+
+#Returns the on-disk cache of finished deterministic videos, shared by every render process.
+def get_video_cache():
+    global _video_cache
+    if _video_cache is None:
+        _video_cache = File_Cache(CURRENT_PROJECT_DIR + "cache/videos/", VIDEO_CACHE_MAX_BYTES, ".mp4")
+    return _video_cache
+
+#The file caches by name, as reported on /metrics.
+def get_file_caches():
+    return {"tts": get_tts_cache(), "videos": get_video_cache()}
+
+#Where a user's finished video is written.
+def user_video_path(usercode):
+    return CURRENT_PROJECT_DIR + "user_output/" + usercode + "/" + usercode + ".mp4"
+
+#Where a user's preview is written, next to the full video.
+def user_preview_path(usercode):
+    return CURRENT_PROJECT_DIR + "user_output/" + usercode + "/" + usercode + "_preview.mp4"
+
+#Seed for deterministic renders. Derived from the doc type and words unless one is given.
+def render_seed(gen_args, seed=None):
+    if seed is not None:
+        return int(seed)
+    return int(cache_key({"words": list(gen_args)})[:16], 16)
+
+#Identifies a deterministic render: same doc type, words and seed give the same video.
+def video_cache_key(gen_args, seed):
+    return cache_key({"version": VIDEO_CACHE_VERSION, "words": list(gen_args), "seed": seed})
+
+#Passes the response body through while adding up the time spent waiting on the network and the bytes received.
+def timed_chunks(chunks, totals):
+    iterator = iter(chunks)
+    while True:
+        start = time.perf_counter()
+        chunk = next(iterator, None)
+        totals["network"] += time.perf_counter() - start
+        if chunk is None:
+            return
+        totals["bytes"] += len(chunk)
+        yield chunk
+
 #This function is responsible for requesting audio from Eleven Labs. There is a python library for this but I didnt want to use it!
-def return_voice_clip(text, voice_id, output_title, path):
-    CHUNK_SIZE = 1024
-    url = "https://api.elevenlabs.io/v1/text-to-speech/" + voice_id
+#Returns the MP3 (bytes), its duration in seconds, worked out from the frame headers as it downloads, and its TTS cache key.
+def return_voice_clip(text, voice_id):
+    CHUNK_SIZE = 64 * 1024
+    url = ELEVENLABS_URL + "/v1/text-to-speech/" + voice_id
 
     headers = {
         "Accept": "audio/mpeg",
@@ -102,81 +253,98 @@ def return_voice_clip(text, voice_id, output_title, path):
         }
     }
 
-    response = requests.post(url, json=data, headers=headers)
-    with open(CURRENT_PROJECT_DIR + path + output_title + '.mp3', 'wb') as f:
-        for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
-            if chunk:
-                f.write(chunk)
-
-#This function combines audio and video to create the final product using the moviepy library.
-def create_clip(usercode, num_voice_clips, movie_type, shot_comp, music):
-    #Delay to begin dialouge
-    VOICE_START_SECONDS = 2
-
-    regular_shots_path = CURRENT_PROJECT_DIR + "footage/" + movie_type + "/regular_shots/"
-    est_shots_path = CURRENT_PROJECT_DIR + "footage/" + movie_type + "/establishing_shots/"
-    special_shots_path = CURRENT_PROJECT_DIR + "footage/" + movie_type + "/special_shots/"
-    gen_folder_path = CURRENT_PROJECT_DIR + "/user_output/" + usercode + "/"
-
-    #Used to keep track of what kinds of shots have been used.
-    est_shots = get_files_in_directory(est_shots_path)
-    regular_shots = get_files_in_directory(regular_shots_path)
-    special_shots = get_files_in_directory(special_shots_path)
-
-    #Music and voice audio synthesis.
-    music_clip = AudioFileClip(CURRENT_PROJECT_DIR + "music/" + music).set_start(0)
-    voice_clips = []
-    current_start_seconds = VOICE_START_SECONDS
-    for clip_num in range(num_voice_clips):     
-        current_clip = AudioFileClip(gen_folder_path + str(clip_num+1) + "_" + usercode + "_" + "DIALOGUE.mp3")
-        voice_clips.append(current_clip.set_start(current_start_seconds))
-        current_start_seconds += current_clip.duration + 1
-
-    #Uses shot comp list to do video synthesis.
-    video_clips = []
-    shot_count = 0
-    total_film_length = current_start_seconds #length of audio plus buffer
-    number_of_shots = len(shot_comp) 
-    print("SHOT LENGTH: " + str(total_film_length/number_of_shots))
-    current_shot_type = est_shots_path
-    for shot_type in shot_comp:
-        #Make sure we are pulling the right type of shot
-        if(shot_type == REG_SHOT):
-            current_shot_type = regular_shots_path
-            current_shot_list = regular_shots
-        elif(shot_type == EST_SHOT):
-            current_shot_type = est_shots_path
-            current_shot_list = est_shots
-        elif(shot_type == SPE_SHOT):
-            current_shot_type = special_shots_path
-            current_shot_list = special_shots
-
+    #Identical lines in the same voice are read from the cache instead of paying for them again.
+    tts_cache = get_tts_cache()
+    key = cache_key({"text": text, "voice_id": voice_id, "model_id": data["model_id"], "voice_settings": data["voice_settings"]})
+    cached_path = tts_cache.get(key)
+    if cached_path is not None:
         try:
-            current_shot = VideoFileClip(current_shot_type + str(current_shot_list.pop(random.randint(0,len(current_shot_list)-1)))) #Grab a random shot and pop
-        
-                    #If the clip we are looking at is shorter than it needs to be we want to loop it
-            if current_shot.duration < total_film_length/number_of_shots:
-                num_loops = int((total_film_length/number_of_shots) / current_shot.duration)
-                current_shot = current_shot.loop(num_loops)
-            video_clips.append(current_shot.set_duration(total_film_length/number_of_shots))
-        except:
-            print("Shot List Empty: " + current_shot_type)
-
-    #Assembling stuff!
-    final_clip = concatenate_videoclips(video_clips)
-
-    #Finalizing audio
-    music_clip = music_clip.subclip(0, final_clip.duration)
-    music_clip = music_clip.volumex(0.5)
-    voice_clips.append(music_clip.subclip(0, final_clip.duration+2))
-    final_clip = final_clip.set_audio(CompositeAudioClip(voice_clips))
-
-    #Adding touch of vfx polish
-    final_clip = vfx.fadeout(final_clip,duration=1, final_color=[0,0,0])
-    final_clip = vfx.fadein(final_clip,duration=1)
-    
-    #Writing output
-    final_clip.write_videofile(gen_folder_path + usercode + ".mp4", codec='libx264', audio_codec='aac')
+            with span("tts.cache_hit"):
+                with open(cached_path, "rb") as f:
+                    mp3 = f.read()
+                return {"mp3": mp3, "duration": mp3_duration(mp3), "key": key}
+        except FileNotFoundError:
+            pass # Evicted by another render in the meantime, fetch it again
+
+    start = time.perf_counter()
+    #The with block hands the connection back to the session's pool even if the download fails halfway.
+    with get_tts_session().post(url, json=data, headers=headers, timeout=TTS_TIMEOUT, stream=True) as response:
+        response.raise_for_status()
+        request_seconds = time.perf_counter() - start
+
+        totals = {"network": 0.0, "bytes": 0}
+        duration = Mp3_Duration()
+        chunks = []
+        for chunk in timed_chunks(response.iter_content(chunk_size=CHUNK_SIZE), totals):
+            duration.feed(chunk)
+            chunks.append(chunk)
+    record_span("tts.network", request_seconds + totals["network"], bytes=totals["bytes"])
+
+    mp3 = b"".join(chunks)
+    with span("tts.write", bytes=len(mp3)):
+        tts_cache.put(key, [mp3])
+    return {"mp3": mp3, "duration": duration.seconds, "key": key}
+
+#Fetches one line and decodes it to PCM. Returns {"pcm": ..., "duration": seconds, "key": TTS cache key}.
+def synthesize_line(text, voice_id):
+    clip = return_voice_clip(text, voice_id)
+    with span("tts.decode", media_seconds=clip["duration"]):
+        return {"pcm": decode_mp3(clip["mp3"]), "duration": clip["duration"], "key": clip["key"]}
+
+#Synthesizes every line of a script at the same time. Returns the lines in script order, see synthesize_line.
+def synthesize_dialogue(script, voice_id, progress_callback=None):
+    report = progress_callback or (lambda fraction: None)
+    with ThreadPoolExecutor(max_workers=TTS_WORKERS) as pool:
+        futures = [
+            pool.submit(
+                contextvars.copy_context().run, # Keeps timing spans attached to this render
+                synthesize_line,
+                line, # Current line
+                voice_id # voice_ID
+            )
+            for line in script
+        ]
+        for finished, future in enumerate(as_completed(futures), 1):
+            future.result() # Raises if the line could not be synthesized
+            report(finished / len(script))
+    return [future.result() for future in futures]
+
+#This function lays out the final product: which shots play for how long, and when each line of dialogue starts.
+#dialogue is the list synthesize_dialogue returns.
+def plan_clip(usercode, dialogue, video_type, rng=random):
+    with span("assets"):
+        catalog = get_asset_catalog()
+    with span("plan"):
+        return build_render_plan(video_type, [line["duration"] for line in dialogue], catalog, user_video_path(usercode), rng,
+                                 [line["key"] for line in dialogue])
+
+#Renders a plan to its output path, timed as the given span.
+def encode_plan(plan, soundtrack, span_name, progress_callback=None):
+    #The old video may be a hard link into the video cache, so it must be unlinked rather than overwritten.
+    if os.path.exists(plan.output.path):
+        os.remove(plan.output.path)
+    with span(span_name, backend=RENDER_BACKEND) as stats:
+        execute_plan(plan, RENDER_BACKEND, progress_callback, soundtrack)
+        stats["media_seconds"] = plan.length
+        stats["bytes"] = os.path.getsize(plan.output.path)
+
+#This function combines audio and video to create the final product. dialogue is the list synthesize_dialogue returns.
+#With a preview_callback, a preview of the same shots and audio is rendered first and its path passed to the callback.
+def create_clip(usercode, dialogue, video_type, progress_callback=None, rng=random, preview_callback=None):
+    report = progress_callback or (lambda fraction: None)
+    plan = plan_clip(usercode, dialogue, video_type, rng)
+    with span("mix", media_seconds=plan.length):
+        soundtrack = mix_soundtrack(plan, [line["pcm"] for line in dialogue], get_music_beds())
+
+    preview_share = 0.0
+    if preview_callback is not None:
+        preview_share = PREVIEW_PROGRESS_SHARE
+        preview = plan.preview(user_preview_path(usercode))
+        encode_plan(preview, soundtrack, "encode.preview", lambda fraction: report(preview_share * fraction))
+        preview_callback(preview.output.path)
+
+    encode_plan(plan, soundtrack, "encode", lambda fraction: report(preview_share + (1 - preview_share) * fraction))
+    return plan
 
 ### VIDEO TYPES AND STRATEGY INTERFACE ###
 
@@ -185,8 +353,13 @@ class Video_Type:
     def generate_script(self, list_of_strings):
         pass
 
-    def generate_video(self, usercode, gen_args, voice_enabled=True):
-        script = self.generate_script(gen_args)
+    #progress_callback (optional) is called with a float between 0 and 1 as the render advances.
+    #rng (optional) picks the shots, pass a seeded random.Random for repeatable videos.
+    #preview_callback (optional) asks for a quick preview first, it is called with the preview's path once written.
+    def generate_video(self, usercode, gen_args, voice_enabled=True, progress_callback=None, rng=random, preview_callback=None):
+        report = progress_callback or (lambda fraction: None)
+        with span("script"):
+            script = self.generate_script(gen_args)
         script_len = len(script)
         gen_folder_path = CURRENT_PROJECT_DIR + usercode
 
@@ -195,153 +368,162 @@ class Video_Type:
             os.mkdir(CURRENT_PROJECT_DIR + "user_output/" + usercode) 
 
         #For debugging
+        dialogue = []
         if voice_enabled:
             #Generate Dialogue
-            line_number = 0
-            for line in script:
-                line_number += 1 #Keep track of the number of lines
-                return_voice_clip(
-                    line, # Current line 
-                    self.voice_code, # voice_ID
-                    (str(line_number) + "_" + usercode + "_" + "DIALOGUE"), # File name
-                    ("user_output/" + usercode + "/") # Directory to be saved to
-                )
+            with span("dialogue", lines=script_len):
+                dialogue = synthesize_dialogue(script, self.voice_code, lambda fraction: report(VOICE_PROGRESS_SHARE * fraction))
         
         #Generate Final Video and save it.
         create_clip(
             usercode, 
-            script_len, 
-            self.video_code, 
-            self.shot_comp,
-            self.music
+            dialogue, 
+            self,
+            lambda fraction: report(VOICE_PROGRESS_SHARE + (1 - VOICE_PROGRESS_SHARE) * fraction),
+            rng,
+            preview_callback
         )
+        report(1.0)
+
+    #Decodes the type's music bed and warns about footage or music it needs but the catalog does not have.
+    #Called once at startup. Returns False if the type has no footage at all, as every render of it would fail.
+    def preload(self, catalog):
+        empty = [shot_type for shot_type in set(self.shot_comp) if not catalog.shot_list(self.video_code, shot_type)]
+        for shot_type in empty:
+            print("Shot List Empty: " + self.video_code + "/" + shot_type)
+        if len(empty) == len(set(self.shot_comp)):
+            return False
+        music_entry = catalog.music_track(self.music)
+        if music_entry is None:
+            print("Music not found: " + self.music)
+        else:
+            get_music_beds().get(music_entry["path"], MUSIC_GAIN)
+        return True
 
-# Concrete strategy
-class Nature_Doc(Video_Type):
-
-    #Here we define the essense of nature documentaries
-    def __init__(self):
-        self.music = "Nature_Doc.mp3"
-        self.shot_comp = [EST_SHOT, EST_SHOT, REG_SHOT, REG_SHOT, SPE_SHOT, SPE_SHOT, EST_SHOT, EST_SHOT]
-        self.voice_code = JACOB_ID
-        self.video_code = VideoTypeEnum.NATURE_DOC.value
-        self.empty_array = [
-            VideoTypeEnum.NATURE_DOC.value, "Adjective", "Noun", "Noun", "Adjective", "Adjective", "Adjective", "Noun", # Line 1
-            "Adjective", "Animal", "Part of the Body", "Adverb", "Verb", "Noun", "Noun", "Adjective", # Line 2
-            "Adjective", "Adjective", "Animal", "Adjective", "Plural Noun", "Part of Body Plural", "Adjective", "Adjective", # Line 3
-            "Adjective", "Verb","Noun", "Noun", "Adjective", "Exclamation" # Line 4
-        ]
+# Concrete strategy, everything about the doc type comes from its script template (see script_template.py).
+class Template_Video_Type(Video_Type):
+    def __init__(self, template):
+        self.template = template
+        self.music = template.music
+        self.shot_comp = template.shot_comp
+        self.voice_code = VOICES[template.voice]
+        self.video_code = template.video_code
+        self.empty_array = [template.video_code] + template.prompts
 
     def generate_script(self, list_of_strings):
-        if len(list_of_strings) < WORD_INPUT_SKIP+28:
-            raise Exception("Invalid Script Arguments: " + str(len(list_of_strings)))
-
-        script = []
-        script.append("Greetings, you " + list_of_strings[WORD_INPUT_SKIP] + " wanderers, to the incredible realm of nature! Where " + list_of_strings[WORD_INPUT_SKIP+1] + " and " + list_of_strings[WORD_INPUT_SKIP+2] + " intertwine, giving birth to a " + list_of_strings[WORD_INPUT_SKIP+3] + " tapestry of life. Embark with us on a " + list_of_strings[WORD_INPUT_SKIP+4] + " journey through the " + list_of_strings[WORD_INPUT_SKIP+5] + " landscapes and unravel the " + list_of_strings[WORD_INPUT_SKIP+6] + " that shrouds our surroundings.")
-        script.append("Our quest unfolds in the very heart of this " + list_of_strings[WORD_INPUT_SKIP+7] + " expanse. Here we see a " + list_of_strings[WORD_INPUT_SKIP+8] + ", its long " + list_of_strings[WORD_INPUT_SKIP+9] + " allows it to " + list_of_strings[WORD_INPUT_SKIP+10] + " " + list_of_strings[WORD_INPUT_SKIP+11] + "its prey. You see, from the majestic " + list_of_strings[WORD_INPUT_SKIP+12] + " to the elusive " + list_of_strings[WORD_INPUT_SKIP+13] + ", this ecosystem works constantly to uphold the delicate equilibrium of this " + list_of_strings[WORD_INPUT_SKIP+14] + " ecosystem.")
-        script.append("Brace yourselves as we venture into the frozen realms of the " + list_of_strings[WORD_INPUT_SKIP+15] + " polar expanse. Here, witness " +list_of_strings[WORD_INPUT_SKIP+16] + " " + list_of_strings[WORD_INPUT_SKIP+17] + " and " +list_of_strings[WORD_INPUT_SKIP+18] + " " + list_of_strings[WORD_INPUT_SKIP+19] + " navigating the icy domain, showcasing their extraordinary " + list_of_strings[WORD_INPUT_SKIP+20] +". These adaptations are vital to survive in this " +list_of_strings[WORD_INPUT_SKIP+21] + ", " +list_of_strings[WORD_INPUT_SKIP+22] + " environment.")
-        script.append("Concluding our spellbinding odyssey through this " +list_of_strings[WORD_INPUT_SKIP+23] + " wilderness, " +list_of_strings[WORD_INPUT_SKIP+24] +" in awe of the sheer majesty that defines this extraordinary biome. It's a testament to the delicate balance of life, where each " +list_of_strings[WORD_INPUT_SKIP+25] + " and " +list_of_strings[WORD_INPUT_SKIP+26] +" contributes to the " +list_of_strings[WORD_INPUT_SKIP+27] +" symphony echoing through the air with a " +list_of_strings[WORD_INPUT_SKIP+28] + "!")
-        return script
-
-# Concrete strategy
-class Space_Doc(Video_Type):
+        return self.template.render(list_of_strings[WORD_INPUT_SKIP:])
 
-    #Here we define the essense of space documentaries
+#Here we define the essense of nature documentaries
+class Nature_Doc(Template_Video_Type):
     def __init__(self):
-        self.music = "Space.mp3"
-        self.shot_comp = [EST_SHOT, EST_SHOT, REG_SHOT, EST_SHOT]
-        self.voice_code = JOSH_ID
-        self.video_code = VideoTypeEnum.SPACE_DOC.value
-        self.empty_array = [
-            VideoTypeEnum.SPACE_DOC.value, "Adjective", "Noun", "Adjective", "Plural Noun",
-            "Noun", "Noun", "Noun", "Noun", "Verb", "Verb",
-            "Plural Noun", "Plural Noun", "Plural Noun", "Person in Room",  "Noun", "Part of the Body", "Verb ending in 'ing'",
-            "Noun", "Adjective", "Plural Noun", "Adjective", "Verb", "Noun", "Verb", "Verb"
-        ]
-
-    def generate_script(self, list_of_strings):
-        if not len(list_of_strings) >= WORD_INPUT_SKIP+25:
-            raise Exception("Invalid Script Arguments: " + str(len(list_of_strings)))
-        
-        """
-        Adjective, Noun, Adjective, Plural Noun # Line 1
-        Noun Noun Noun Noun, Verb, Verb
-        Plural Noun, Plural Noun, Plural Noun, Person in Room,  Noun, Part of the Body, Verb ending in 'ing'
-        Noun, Adjective, Plural Noun, Adjective, Verb, Noun, Verb, Verb
-        """
-        script = []
-        script.append("In the vastness of the cosmos, our tiny " + list_of_strings[WORD_INPUT_SKIP] + " planet is just a speck. But human curiosity knows no " + list_of_strings[WORD_INPUT_SKIP+1] + ". Please, join me on a " + list_of_strings[WORD_INPUT_SKIP+2] + " journey as we explore the wonders of the universe, and discover all the little " + list_of_strings[WORD_INPUT_SKIP+3] + " it has to offer.")
-        script.append("From the very first steps on the " + list_of_strings[WORD_INPUT_SKIP+4] + " to the distant probes venturing into the outer reaches of our solar system, humanity has reached for the " + list_of_strings[WORD_INPUT_SKIP+5] + ". But our journey has just begun. With modern technology such as the " + list_of_strings[WORD_INPUT_SKIP+6] + " and the " + list_of_strings[WORD_INPUT_SKIP+7] + ", we are now able to " + list_of_strings[WORD_INPUT_SKIP+8] + ", and " + list_of_strings[WORD_INPUT_SKIP+9] + ", our way into the cosmos.")
-        script.append("Our cosmic backyard, the solar system, is a mesmerizing dance of " + list_of_strings[WORD_INPUT_SKIP+10] + ", " + list_of_strings[WORD_INPUT_SKIP+11] + ", and celestial " + list_of_strings[WORD_INPUT_SKIP+12] + ", where each planet holds its own secrets and unique characteristics. For example, on this world, discovered by the great scientist " + list_of_strings[WORD_INPUT_SKIP+13] + ", slight changes in its " + list_of_strings[WORD_INPUT_SKIP+14] + " lead us to believe there may be aliens whose " + list_of_strings[WORD_INPUT_SKIP+15] + " are " + list_of_strings[WORD_INPUT_SKIP+16] + ".")
-        script.append("In our quest to understand the cosmos, we find not only " + list_of_strings[WORD_INPUT_SKIP+17] + " but also a deeper appreciation for the many " + list_of_strings[WORD_INPUT_SKIP+18] + " " + list_of_strings[WORD_INPUT_SKIP+19] + " to be found in the void, and the " + list_of_strings[WORD_INPUT_SKIP+20] + " nature of our universe. As we " + list_of_strings[WORD_INPUT_SKIP+21] + " beyond the horizons of distant worlds, may our " + list_of_strings[WORD_INPUT_SKIP+22] + " continue to " + list_of_strings[WORD_INPUT_SKIP+23] + " and " + list_of_strings[WORD_INPUT_SKIP+24] + " into the future.")
-        return script
-
-# Concrete strategy
-class Corporate_Intro(Video_Type):
+        super().__init__(SCRIPT_TEMPLATES[VideoTypeEnum.NATURE_DOC.value])
 
+#Here we define the essense of space documentaries
+class Space_Doc(Template_Video_Type):
     def __init__(self):
-        self.music = "promo.mp3"
-        self.shot_comp = [REG_SHOT, REG_SHOT, REG_SHOT, REG_SHOT, REG_SHOT, REG_SHOT, REG_SHOT, REG_SHOT]
-        self.voice_code = SALLY_ID
-        self.video_code = VideoTypeEnum.CORPORATE_INTRO.value
-        self.empty_array = [
-            VideoTypeEnum.CORPORATE_INTRO.value,
-            "Company Name", "Adjective", "Noun", "Noun",
-            "Verb", "Adjective", "Adjective", "Plural Noun", "Noun", "Adjective", "Plural Noun", "Adjective",
-            "Noun", "Noun", "Verb ending in 'ing'", "Verb", "Verb", "Plural Noun", "Plural Noun", "Verb ending in 'ing'",
-            "Noun", "Noun", "Noun", "Exclamation"
-        ]
-
-    def generate_script(self, list_of_strings):
-        if not len(list_of_strings) >= WORD_INPUT_SKIP+23:
-            raise Exception("Invalid Script Arguments: " + str(len(list_of_strings)))
+        super().__init__(SCRIPT_TEMPLATES[VideoTypeEnum.SPACE_DOC.value])
 
-        script = []
-        script.append("Welcome to the team! We're thrilled to have you on board at " + list_of_strings[WORD_INPUT_SKIP] + ". As you embark on this " + list_of_strings[WORD_INPUT_SKIP+1] + " journey with us, let's walk through what you can expect as a valuable member and " + list_of_strings[WORD_INPUT_SKIP+2] + ", here in our workplace family. Together, let's make every " + list_of_strings[WORD_INPUT_SKIP+3] + " at " + list_of_strings[WORD_INPUT_SKIP] + " a rewarding experience!")
-        script.append("First and foremost, take a moment to get to " + list_of_strings[WORD_INPUT_SKIP+4] + " your colleagues. We believe in fostering a " + list_of_strings[WORD_INPUT_SKIP+5] + " and " + list_of_strings[WORD_INPUT_SKIP+6] + " environment where " + list_of_strings[WORD_INPUT_SKIP+7] + " are valued. Don't hesitate to introduce your " + list_of_strings[WORD_INPUT_SKIP+8] + " and feel free to ask " + list_of_strings[WORD_INPUT_SKIP+9] + " questions, we're here to help! Need a break? Our kitchen is stocked with " + list_of_strings[WORD_INPUT_SKIP+10] + ", and the break area is a " + list_of_strings[WORD_INPUT_SKIP+11] + " place to unwind.")
-        script.append("You'll find that we take pride in our core values. " + list_of_strings[WORD_INPUT_SKIP+12] + ", " + list_of_strings[WORD_INPUT_SKIP+13] + ", and " + list_of_strings[WORD_INPUT_SKIP+14] + ", to drive our success. Only you can " + list_of_strings[WORD_INPUT_SKIP+15] + " yourself with these values and let them " + list_of_strings[WORD_INPUT_SKIP+16] + " your work interactions with your fellow " + list_of_strings[WORD_INPUT_SKIP+17] + ". It's important you know that our greatest achievement will always be " + list_of_strings[WORD_INPUT_SKIP+18] + ", and " + list_of_strings[WORD_INPUT_SKIP+19] + " all of our employees.")
-        script.append("So once again, welcome to the team! We're confident that your " + list_of_strings[WORD_INPUT_SKIP+20] + " and " + list_of_strings[WORD_INPUT_SKIP+21] + " will contribute to our workplace " + list_of_strings[WORD_INPUT_SKIP+22] + ". If you have any questions or need assistance, your team is here for you. And as always, remember the company motto! " + list_of_strings[WORD_INPUT_SKIP+23] + "!")
-        return script
+class Corporate_Intro(Template_Video_Type):
+    def __init__(self):
+        super().__init__(SCRIPT_TEMPLATES[VideoTypeEnum.CORPORATE_INTRO.value])
 
 # Context class that uses the strategy
 class Video_Generator:
     def __init__(self, Video_Type):
         self.video_type = Video_Type
 
-    def generate_video(self, usercode, gen_args, voice_enabled=True):
-        self.video_type.generate_video(usercode, gen_args, voice_enabled)
+    def generate_video(self, usercode, gen_args, voice_enabled=True, progress_callback=None, rng=random, preview_callback=None):
+        self.video_type.generate_video(usercode, gen_args, voice_enabled, progress_callback, rng, preview_callback)
+
+### VIDEO TYPE REGISTRY ###
+
+# Doc types with a class of their own, the other templates get a plain Template_Video_Type.
+VIDEO_TYPE_CLASSES = {
+    VideoTypeEnum.NATURE_DOC.value: Nature_Doc,
+    VideoTypeEnum.SPACE_DOC.value: Space_Doc,
+    VideoTypeEnum.CORPORATE_INTRO.value: Corporate_Intro
+}
+
+# One instance of every doc type, built once. Video types keep no per-render state, so renders share them.
+VIDEO_TYPES = {
+    video_code: VIDEO_TYPE_CLASSES[video_code]() if video_code in VIDEO_TYPE_CLASSES else Template_Video_Type(template)
+    for video_code, template in SCRIPT_TEMPLATES.items()
+}
+
+#Returns the video type for a doc type value, or None if there is no such type.
+def get_video_type(doc_type):
+    return VIDEO_TYPES.get(doc_type)
+
+#Indexes footage and music and checks every doc type has what it needs, so the first request does not pay for it.
+#Types without any footage are dropped from VIDEO_TYPES and answered as unknown.
+def preload_video_types():
+    catalog = get_asset_catalog()
+    for video_code, video_type in list(VIDEO_TYPES.items()):
+        if not video_type.preload(catalog):
+            print("No footage for " + video_code + ", not serving it")
+            del VIDEO_TYPES[video_code]
 
 # Used by API
-# TODO: Refactor into factory method.
-def API_CREATE_VIDEO(usercode, gen_args):
-    match gen_args[DOC_TYPE_INDEX]:
-        case VideoTypeEnum.NATURE_DOC.value:
-            video_type = Nature_Doc()
-        case VideoTypeEnum.SPACE_DOC.value:
-            video_type = Space_Doc()
-        case VideoTypeEnum.CORPORATE_INTRO.value:
-            video_type = Corporate_Intro()
-        case _:
-            return False
-        
+#Estimates the memory (bytes) and file handles rendering gen_args will need, before anything is synthesized.
+def API_ESTIMATE_RENDER(gen_args):
+    video_type = get_video_type(gen_args[DOC_TYPE_INDEX])
+    if video_type is None:
+        return {"bytes": 0, "handles": 0} # Fails straight away
+    try:
+        dialogue_seconds = sum(len(line) for line in video_type.generate_script(gen_args)) / SPEECH_CHARACTERS_PER_SECOND
+    except Exception:
+        dialogue_seconds = 0 # Bad arguments, fails straight away too
+
+    #Output size follows the first shot, as in build_render_plan.
+    size = DEFAULT_SIZE
+    first_shots = get_asset_catalog().shot_list(video_type.video_code, video_type.shot_comp[0])
+    if first_shots and first_shots[0]["size"]:
+        size = first_shots[0]["size"]
+    return estimate_render_cost(len(video_type.shot_comp), 2, size, RENDER_BACKEND, dialogue_seconds)
+
+# Used by API
+#deterministic=True seeds the shot choice from the words (or from seed) and reuses a cached video when there is one.
+#preview=True renders a low resolution preview (see user_preview_path) before the full video, preview_callback
+#(optional) is called with its path as soon as it is written. Cached videos skip the preview.
+def API_CREATE_VIDEO(usercode, gen_args, progress_callback=None, deterministic=False, seed=None, preview=False, preview_callback=None):
+    if preview and preview_callback is None:
+        preview_callback = lambda path: None
+    video_type = get_video_type(gen_args[DOC_TYPE_INDEX])
+    if video_type is None:
+        return False
+
+    rng = random
+    if deterministic:
+        seed = render_seed(gen_args, seed)
+        key = video_cache_key(gen_args, seed)
+        cached_path = get_video_cache().get(key)
+        if cached_path is not None:
+            try:
+                with span("video_cache_hit"):
+                    os.makedirs(CURRENT_PROJECT_DIR + "user_output/" + usercode, exist_ok=True)
+                    link_file(cached_path, user_video_path(usercode))
+                if progress_callback is not None:
+                    progress_callback(1.0)
+                return True
+            except FileNotFoundError:
+                pass # Evicted by another render in the meantime, render it again
+        rng = random.Random(seed)
+
     # Client uses the selected strategy
     generator = Video_Generator(video_type)
     #We generate based on that.
-    generator.generate_video(usercode, gen_args, USE_VOICE) # Change this boolean value to False to test without voice gen
+    generator.generate_video(usercode, gen_args, USE_VOICE, progress_callback, rng, preview_callback if preview else None) # Change this boolean value to False to test without voice gen
 
+    if deterministic:
+        get_video_cache().put_file(key, user_video_path(usercode))
     return True
 
 # Used by API
 def API_RETURN_SCRIPT(type):
-    match type:
-        case VideoTypeEnum.NATURE_DOC.value:
-            return Nature_Doc().empty_array
-        case VideoTypeEnum.SPACE_DOC.value:
-            return Space_Doc().empty_array
-        case VideoTypeEnum.CORPORATE_INTRO.value:
-            return Corporate_Intro().empty_array
-        case _:
-            return False
+    video_type = get_video_type(type)
+    if video_type is None:
+        return False
+    return video_type.empty_array
 
 # Used by API
 def API_CLEAN_USERCODE(usercode):
@@ -0,0 +1,89 @@
+# MP3 duration from frame headers alone, no decoding. Fed chunk by chunk, so the length of a line of dialogue is
+# known the moment its download finishes.
+
+# Bitrates in kbps, by (MPEG version is 1, layer) and bitrate index. Index 0 (free format) and 15 are not supported.
+BITRATES = {
+    (True, 1): [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+    (True, 2): [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+    (True, 3): [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    (False, 1): [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+    (False, 2): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    (False, 3): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+
+# Sample rates by version bits (3: MPEG 1, 2: MPEG 2, 0: MPEG 2.5) and sample rate index.
+SAMPLE_RATES = {3: [44100, 48000, 32000], 2: [22050, 24000, 16000], 0: [11025, 12000, 8000]}
+
+HEADER_SIZE = 4
+ID3_HEADER_SIZE = 10
+
+#Returns (frame length in bytes, samples in the frame, sample rate), or None if the 4 bytes are not a frame header.
+def parse_frame_header(header):
+    if header[0] != 0xFF or header[1] & 0xE0 != 0xE0:
+        return None
+    version = (header[1] >> 3) & 0x3
+    layer = 4 - ((header[1] >> 1) & 0x3)
+    bitrate_index = header[2] >> 4
+    rate_index = (header[2] >> 2) & 0x3
+    if version == 1 or layer == 4 or bitrate_index in (0, 15) or rate_index == 3:
+        return None
+
+    mpeg1 = version == 3
+    bitrate = BITRATES[(mpeg1, layer)][bitrate_index] * 1000
+    sample_rate = SAMPLE_RATES[version][rate_index]
+    padding = (header[2] >> 1) & 0x1
+    if layer == 1:
+        return (12 * bitrate // sample_rate + padding) * 4, 384, sample_rate
+    samples = 1152 if mpeg1 or layer == 2 else 576
+    return samples // 8 * bitrate // sample_rate + padding, samples, sample_rate
+
+class Mp3_Duration:
+    def __init__(self):
+        self.seconds = 0.0
+        self.frames = 0
+        self.buffer = bytearray()
+        self.skip = 0 # Bytes of an ID3 tag still to be skipped
+        self.started = False
+
+    #Counts the frames in the next chunk of the file. Partial frames wait for the next chunk.
+    def feed(self, chunk):
+        self.buffer += chunk
+        position = min(self.skip, len(self.buffer))
+        self.skip -= position
+
+        while len(self.buffer) - position >= ID3_HEADER_SIZE or (self.started and len(self.buffer) - position >= HEADER_SIZE):
+            if self.buffer[position:position + 3] == b"ID3":
+                if len(self.buffer) - position < ID3_HEADER_SIZE:
+                    break
+                # ID3v2 size is "syncsafe", 7 bits per byte, and excludes the header (and footer, if flagged).
+                size = 0
+                for byte in self.buffer[position + 6:position + 10]:
+                    size = (size << 7) | (byte & 0x7F)
+                size += ID3_HEADER_SIZE * (2 if self.buffer[position + 5] & 0x10 else 1)
+                skipped = min(size, len(self.buffer) - position)
+                position += skipped
+                self.skip = size - skipped
+                continue
+
+            frame = parse_frame_header(self.buffer[position:position + HEADER_SIZE])
+            if frame is None:
+                position += 1 # Not a frame, look for the next sync word
+                continue
+            length, samples, sample_rate = frame
+            if len(self.buffer) - position < length:
+                break
+            # A Xing/Info frame at the start only describes the stream, decoders skip it.
+            tag = self.buffer[position:position + min(length, 64)]
+            if self.started or (b"Xing" not in tag and b"Info" not in tag):
+                self.seconds += samples / sample_rate
+                self.frames += 1
+            self.started = True
+            position += length
+
+        del self.buffer[:position]
+
+#Duration of a complete MP3, in seconds.
+def mp3_duration(data):
+    parser = Mp3_Duration()
+    parser.feed(data)
+    return parser.seconds
@@ -0,0 +1,388 @@
+# Standard python imports
+import os
+import shutil
+import tempfile
+import threading
+import subprocess
+from contextlib import ExitStack
+from concurrent.futures import ThreadPoolExecutor
+
+# Moviepy module imports
+from moviepy.editor import VideoFileClip, AudioFileClip, CompositeAudioClip
+from moviepy.editor import concatenate_videoclips
+from moviepy.audio.AudioClip import AudioArrayClip
+from moviepy.video import vfx
+from moviepy.config import get_setting
+from proglog import ProgressBarLogger
+
+from audio import SAMPLE_RATE, CHANNELS, pcm_input_args, pcm_bytes
+from ingest import encoder_params, matches_normalized, on_keyframe, NORMALIZED_FPS
+from render_plan import DIALOGUE_INPUT
+
+# Muxer flags for fragmented MP4: an empty moov up front, then self contained fragments starting on keyframes.
+FRAGMENTED_MOVFLAGS = "frag_keyframe+empty_moov+default_base_moof"
+
+# ffmpeg's stderr is read in chunks of STREAM_READ_BYTES, the last ERROR_TAIL_BYTES are kept for error messages.
+STREAM_READ_BYTES = 64 * 1024
+ERROR_TAIL_BYTES = 16 * 1024
+
+# Shots encoded at the same time by the segments backend, defaults to one per core.
+SEGMENT_WORKERS = int(os.environ.get("MADLIB_SEGMENT_WORKERS", os.cpu_count() or 1))
+
+# Rough per-input costs, used by the render queue to decide when a render may start (see jobs.py).
+DECODER_BYTES = 48 * 1024 * 1024 # A decoder (ffmpeg process or moviepy reader) and its buffers
+BUFFERED_FRAMES = 4 # Decoded frames held per video input
+HANDLES_PER_INPUT = 3 # Pipes or files per input
+BASE_HANDLES = 8 # Output file, progress pipe, logs...
+
+#Estimates the peak memory (bytes) and file handles a render needs.
+def estimate_render_cost(video_inputs, audio_inputs, size, backend, dialogue_seconds=0):
+    frame_bytes = size[0] * size[1] * 3
+    memory = (video_inputs + audio_inputs) * DECODER_BYTES + video_inputs * BUFFERED_FRAMES * frame_bytes
+    memory += int(dialogue_seconds * SAMPLE_RATE * CHANNELS * 4) * 2 # Decoded lines, and the soundtrack they are mixed onto
+    if backend == "moviepy":
+        memory += video_inputs * BUFFERED_FRAMES * frame_bytes # Every frame is copied into NumPy as well
+    return {"bytes": memory, "handles": (video_inputs + audio_inputs) * HANDLES_PER_INPUT + BASE_HANDLES}
+
+#Extra muxer arguments for the output container.
+def container_params(output):
+    if output.fragmented:
+        return ["-movflags", FRAGMENTED_MOVFLAGS]
+    return ["-movflags", "+faststart"]
+
+#Encoder arguments for the output's video stream.
+def video_codec_params(output):
+    params = ["-c:v", output.video_codec, "-pix_fmt", output.pixel_format]
+    if output.preset is not None:
+        params += ["-preset", output.preset]
+    return params
+
+#Adapts moviepy's progress bars into a callback that receives the fraction of frames written.
+class Render_Progress_Logger(ProgressBarLogger):
+    def __init__(self, progress_callback):
+        super().__init__()
+        self.progress_callback = progress_callback
+
+    def bars_callback(self, bar, attr, value, old_value=None):
+        if bar == "t" and attr == "index" and self.bars[bar]["total"]:
+            self.progress_callback(value / self.bars[bar]["total"])
+
+### MOVIEPY BACKEND ###
+
+#Raises if the plan's audio can only come from a premixed soundtrack (see mix_soundtrack in audio.py) and none was given.
+def check_soundtrack(plan, soundtrack):
+    if soundtrack is None and any(track.path == DIALOGUE_INPUT for track in plan.audio):
+        raise ValueError("Plan has a dialogue track but no soundtrack was given")
+
+#Renders a plan through moviepy's frame pipeline. Slow, but works with any footage moviepy can read.
+#Every clip opened is closed before returning, even on failure, so no ffmpeg reader outlives its render.
+def render_moviepy(plan, progress_callback=None, soundtrack=None):
+    check_soundtrack(plan, soundtrack)
+    with ExitStack() as opened:
+        _render_moviepy(plan, progress_callback, soundtrack, opened)
+
+#Mixes the plan's audio files with moviepy, for plans rendered without a premixed soundtrack.
+def moviepy_audio(plan, track_clip):
+    audio_clips = []
+    for track in plan.audio:
+        audio_clip = track_clip(AudioFileClip(track.path))
+        out_point = audio_clip.duration if track.out_point is None else min(track.out_point, audio_clip.duration)
+        audio_clip = audio_clip.subclip(track.in_point, out_point)
+        if track.gain != 1.0:
+            audio_clip = audio_clip.volumex(track.gain)
+        audio_clips.append(audio_clip.set_start(track.start))
+    return track_clip(CompositeAudioClip(audio_clips))
+
+#Scales a clip to fit inside size, keeping its aspect ratio, and centres it on black bars.
+#Same result as the scale and pad filters in shot_filter.
+def fit_to_size(clip, size):
+    width, height = size
+    if tuple(clip.size) == (width, height):
+        return clip
+    scale = min(width / clip.w, height / clip.h)
+    clip = vfx.resize(clip, (max(1, int(clip.w * scale)), max(1, int(clip.h * scale))))
+    if tuple(clip.size) == (width, height):
+        return clip
+    return clip.on_color(size=(width, height), color=(0, 0, 0), pos="center")
+
+def _render_moviepy(plan, progress_callback, soundtrack, opened):
+    #Registers a clip for closing. Derived clips (loop, subclip...) share the reader of their source.
+    def track_clip(clip):
+        opened.callback(clip.close)
+        return clip
+
+    video_clips = []
+    for shot in plan.shots:
+        current_shot = track_clip(VideoFileClip(shot.path, audio=False))
+        #If the clip we are looking at is shorter than it needs to be we want to loop it
+        if shot.loops > 1:
+            current_shot = current_shot.loop(shot.loops)
+        current_shot = current_shot.subclip(shot.in_point, shot.out_point)
+        video_clips.append(fit_to_size(current_shot, plan.output.size))
+
+    #Assembling stuff!
+    final_clip = track_clip(concatenate_videoclips(video_clips))
+    if soundtrack is not None:
+        final_clip = final_clip.set_audio(AudioArrayClip(soundtrack, fps=SAMPLE_RATE))
+    else:
+        final_clip = final_clip.set_audio(moviepy_audio(plan, track_clip))
+
+    #Adding touch of vfx polish
+    final_clip = vfx.fadeout(final_clip, duration=plan.fade_out, final_color=[0,0,0])
+    final_clip = vfx.fadein(final_clip, duration=plan.fade_in)
+
+    #Writing output
+    output = plan.output
+    logger = "bar" if progress_callback is None else Render_Progress_Logger(progress_callback)
+    final_clip.write_videofile(output.path, fps=output.fps, codec=output.video_codec, audio_codec=output.audio_codec,
+                               preset=output.preset or "medium", ffmpeg_params=container_params(output), logger=logger)
+
+### FFMPEG BACKEND ###
+
+#Input arguments and filter for one shot: loop the input as often as needed, cut it to length and bring it to
+#the output format. The filter reads input `index` and ends in the label [v<index>].
+def shot_filter(shot, index, output):
+    width, height = output.size
+    arguments = ["-stream_loop", str(shot.loops - 1), "-i", shot.path]
+    return arguments, (
+        "[{i}:v]trim=start={start:.3f}:end={end:.3f},setpts=PTS-STARTPTS,"
+        "scale={w}:{h}:force_original_aspect_ratio=decrease,pad={w}:{h}:(ow-iw)/2:(oh-ih)/2,"
+        "setsar=1,fps={fps},format={pix}[v{i}]".format(
+            i=index, start=shot.in_point, end=shot.out_point, w=width, h=height, fps=output.fps, pix=output.pixel_format)
+    )
+
+#Input arguments and filters for the audio: cut each track, set its level, delay it to its start and sum
+#everything into [aout]. Tracks are numbered from first_input on. Only used without a premixed soundtrack.
+def audio_filters(plan, first_input=0):
+    arguments = []
+    filters = []
+    audio_labels = []
+    for index, track in enumerate(plan.audio, first_input):
+        arguments += ["-i", track.path]
+        trim = "atrim=start={:.3f}".format(track.in_point)
+        if track.out_point is not None:
+            trim += ":end={:.3f}".format(track.out_point)
+        filters.append("[{i}:a]{trim},asetpts=PTS-STARTPTS,volume={g},adelay=delays={ms}:all=1[a{i}]".format(
+            i=index, trim=trim, g=track.gain, ms=int(track.start * 1000)))
+        audio_labels.append("[a%d]" % index)
+    filters.append("{labels}amix=inputs={n}:duration=longest:dropout_transition=0:normalize=0[aout]".format(
+        labels="".join(audio_labels), n=len(audio_labels)))
+    return arguments, filters
+
+#Input arguments, filters and the stream to map for the audio. A premixed soundtrack is read from stdin as is.
+def soundtrack_inputs(plan, piped_soundtrack, first_input=0):
+    if piped_soundtrack:
+        return pcm_input_args(), [], "%d:a" % first_input
+    arguments, filters = audio_filters(plan, first_input)
+    return arguments, filters, "[aout]"
+
+#Builds a single ffmpeg invocation that does the whole render inside ffmpeg's filter graph.
+def ffmpeg_command(plan, piped_soundtrack=False):
+    output = plan.output
+    length = plan.length
+    command = [get_setting("FFMPEG_BINARY"), "-y", "-loglevel", "error", "-nostats", "-progress", "pipe:1"]
+    filters = []
+
+    for index, shot in enumerate(plan.shots):
+        arguments, shot_graph = shot_filter(shot, index, output)
+        command += arguments
+        filters.append(shot_graph)
+    shot_labels = "".join("[v%d]" % index for index in range(len(plan.shots)))
+    filters.append(
+        "{labels}concat=n={n}:v=1:a=0,fade=t=in:st=0:d={fade_in},fade=t=out:st={out:.3f}:d={fade_out}[vout]".format(
+            labels=shot_labels, n=len(plan.shots), fade_in=plan.fade_in, fade_out=plan.fade_out, out=max(0, length - plan.fade_out))
+    )
+
+    arguments, mix_graph, audio_map = soundtrack_inputs(plan, piped_soundtrack, len(plan.shots))
+    command += arguments
+    filters += mix_graph
+
+    command += [
+        "-filter_complex", ";".join(filters),
+        "-map", "[vout]", "-map", audio_map,
+        *video_codec_params(output), "-c:a", output.audio_codec,
+        "-t", "%.3f" % length,
+        *container_params(output),
+        output.path
+    ]
+    return command
+
+#Writes the soundtrack into ffmpeg's stdin and closes it. ffmpeg may stop reading early, e.g. when it fails.
+def feed_stdin(process, data):
+    try:
+        process.stdin.write(data)
+        process.stdin.close()
+    except (BrokenPipeError, ValueError):
+        pass
+
+#Reads ffmpeg's stderr until it closes, keeping only the last ERROR_TAIL_BYTES in tail (a bytearray) for the error
+#message. Without a reader, a full pipe blocks ffmpeg while we wait on its stdout, and the render never ends.
+def drain_stderr(process, tail):
+    for chunk in iter(lambda: process.stderr.read(STREAM_READ_BYTES), b""):
+        tail += chunk
+        del tail[:-ERROR_TAIL_BYTES]
+
+#Renders a plan with one ffmpeg process, no frames ever pass through Python.
+def render_ffmpeg(plan, progress_callback=None, soundtrack=None):
+    check_soundtrack(plan, soundtrack)
+    stdin = subprocess.DEVNULL if soundtrack is None else subprocess.PIPE
+    command = ffmpeg_command(plan, soundtrack is not None)
+    #The with block closes the pipes and reaps ffmpeg, even if a progress callback raises.
+    with subprocess.Popen(command, stdin=stdin, stdout=subprocess.PIPE, stderr=subprocess.PIPE) as process:
+        #Fed from a thread, ffmpeg reads it at its own pace while we read its progress.
+        feeder = None
+        if soundtrack is not None:
+            feeder = threading.Thread(target=feed_stdin, args=(process, pcm_bytes(soundtrack)), daemon=True)
+            feeder.start()
+        errors = bytearray()
+        drainer = threading.Thread(target=drain_stderr, args=(process, errors), daemon=True)
+        drainer.start()
+        try:
+            #-progress prints key=value lines, out_time_us tells us how far into the video the encoder is.
+            for line in process.stdout:
+                key, _, value = line.decode().strip().partition("=")
+                if key == "out_time_us" and progress_callback is not None and value.isdigit():
+                    progress_callback(min(1.0, int(value) / 1e6 / plan.length))
+        except BaseException:
+            process.kill()
+            raise
+        finally:
+            drainer.join()
+            if feeder is not None:
+                feeder.join()
+    if process.returncode != 0:
+        raise RuntimeError("ffmpeg render failed: " + errors.decode(errors="replace").strip())
+
+### SEGMENTS BACKEND ###
+
+#Runs one short ffmpeg job to completion, input (optional) is written to its stdin.
+def run_ffmpeg(command, input=None):
+    result = subprocess.run(command, input=input, stdin=subprocess.DEVNULL if input is None else None, capture_output=True)
+    if result.returncode != 0:
+        raise RuntimeError("ffmpeg failed: " + result.stderr.decode(errors="replace").strip())
+
+#True when shot `index` can be copied out of its normalized file: the output is in the normalized format, the shot
+#is not looped, both cuts fall on keyframes and no fade touches it.
+def can_copy_shot(plan, index):
+    shot = plan.shots[index]
+    return (shot.normalized and shot.loops == 1 and 0 < index < len(plan.shots) - 1
+            and matches_normalized(plan.output) and on_keyframe(shot.in_point) and on_keyframe(shot.out_point))
+
+#Cuts shot `index` out of its normalized file without re-encoding it. See can_copy_shot. The cut is made by frame
+#count rather than time and its timestamps are shifted to start at 0, so copied pieces join without overlapping.
+def copy_segment_command(plan, index, path):
+    shot = plan.shots[index]
+    return [
+        get_setting("FFMPEG_BINARY"), "-y", "-loglevel", "error", "-nostats",
+        "-ss", "%.3f" % shot.in_point, "-i", shot.path,
+        "-map", "0:v", "-an", "-c", "copy", "-frames:v", str(round(shot.duration * NORMALIZED_FPS)),
+        "-avoid_negative_ts", "make_zero",
+        path
+    ]
+
+#Encodes shot `index` on its own, video only. The first and last shots carry the fade in and out.
+#Output in the normalized format is encoded with ingest.py's settings, so it joins with copied shots.
+def segment_command(plan, index, path, threads):
+    if can_copy_shot(plan, index):
+        return copy_segment_command(plan, index, path)
+    shot = plan.shots[index]
+    output = plan.output
+    codec_params = encoder_params() if matches_normalized(output) else video_codec_params(output)
+    arguments, graph = shot_filter(shot, 0, output)
+    fades = []
+    if index == 0:
+        fades.append("fade=t=in:st=0:d={}".format(plan.fade_in))
+    if index == len(plan.shots) - 1:
+        fades.append("fade=t=out:st={:.3f}:d={}".format(max(0, shot.duration - plan.fade_out), plan.fade_out))
+    if fades:
+        graph = graph[:-len("[v0]")] + "," + ",".join(fades) + "[v0]"
+    return [
+        get_setting("FFMPEG_BINARY"), "-y", "-loglevel", "error", "-nostats", *arguments,
+        "-filter_complex", graph, "-map", "[v0]", "-an",
+        *codec_params, "-threads", str(threads),
+        "-t", "%.3f" % shot.duration,
+        path
+    ]
+
+#Encodes the whole soundtrack once, mixing it first unless it is piped in premixed.
+def soundtrack_command(plan, path, piped_soundtrack=False):
+    arguments, filters, audio_map = soundtrack_inputs(plan, piped_soundtrack)
+    if filters:
+        arguments += ["-filter_complex", ";".join(filters)]
+    return [
+        get_setting("FFMPEG_BINARY"), "-y", "-loglevel", "error", "-nostats", *arguments,
+        "-map", audio_map, "-c:a", plan.output.audio_codec, "-t", "%.3f" % plan.length,
+        path
+    ]
+
+#Joins the segments and the soundtrack into the output without re-encoding either.
+def join_command(plan, list_path, soundtrack_path):
+    return [
+        get_setting("FFMPEG_BINARY"), "-y", "-loglevel", "error", "-nostats",
+        "-f", "concat", "-safe", "0", "-i", list_path, "-i", soundtrack_path,
+        "-map", "0:v", "-map", "1:a", "-c", "copy", "-t", "%.3f" % plan.length,
+        *container_params(plan.output),
+        plan.output.path
+    ]
+
+#Renders a plan by encoding every shot in its own ffmpeg process, `workers` at a time, while the soundtrack is
+#encoded alongside. Normalized shots between the fades are copied instead (see can_copy_shot). The pieces share
+#codec settings, so the concat demuxer joins them losslessly.
+def render_segments(plan, progress_callback=None, soundtrack=None, workers=None):
+    check_soundtrack(plan, soundtrack)
+    report = progress_callback or (lambda fraction: None)
+    workers = max(1, min(workers or SEGMENT_WORKERS, len(plan.shots)))
+    threads = max(1, (os.cpu_count() or 1) // workers) # Keeps the encoders from fighting over cores
+    parts_dir = tempfile.mkdtemp(prefix=".segments_", dir=os.path.dirname(os.path.abspath(plan.output.path)))
+    try:
+        segment_paths = [os.path.join(parts_dir, "%03d.mp4" % index) for index in range(len(plan.shots))]
+        soundtrack_path = os.path.join(parts_dir, "soundtrack.m4a")
+        with ThreadPoolExecutor(max_workers=workers + 1) as pool:
+            audio = pool.submit(
+                run_ffmpeg,
+                soundtrack_command(plan, soundtrack_path, soundtrack is not None),
+                None if soundtrack is None else pcm_bytes(soundtrack)
+            )
+            segments = [
+                pool.submit(run_ffmpeg, segment_command(plan, index, path, threads))
+                for index, path in enumerate(segment_paths)
+            ]
+            encoded = 0.0
+            for index, segment in enumerate(segments):
+                segment.result() # Raises if the segment could not be encoded
+                encoded += plan.shots[index].duration
+                report(0.95 * encoded / plan.length)
+            audio.result()
+
+        list_path = os.path.join(parts_dir, "segments.txt")
+        with open(list_path, "w") as f:
+            for path in segment_paths:
+                f.write("file '%s'\n" % path.replace("'", "'\\''"))
+        run_ffmpeg(join_command(plan, list_path, soundtrack_path))
+        report(1.0)
+    finally:
+        shutil.rmtree(parts_dir, ignore_errors=True)
+
+### BACKEND SELECTION ###
+
+#Executors take a Render_Plan (see render_plan.py), an optional progress callback and the plan's premixed soundtrack.
+RENDER_BACKENDS = {
+    "ffmpeg": render_ffmpeg,
+    "moviepy": render_moviepy,
+    "segments": render_segments,
+}
+
+# Used whenever the chosen backend fails.
+FALLBACK_BACKEND = "moviepy"
+
+#Renders a plan with the named backend, retrying with moviepy if it fails.
+def execute_plan(plan, backend, progress_callback=None, soundtrack=None):
+    try:
+        RENDER_BACKENDS[backend](plan, progress_callback, soundtrack)
+    except Exception as e:
+        if backend == FALLBACK_BACKEND:
+            raise
+        print(f"Render backend {backend} failed, falling back to {FALLBACK_BACKEND}: {e}")
+        if os.path.exists(plan.output.path):
+            os.remove(plan.output.path)
+        RENDER_BACKENDS[FALLBACK_BACKEND](plan, progress_callback, soundtrack)
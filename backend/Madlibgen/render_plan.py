@@ -0,0 +1,183 @@
+# Standard python imports
+import math
+import json
+import random
+from dataclasses import dataclass, field, asdict, replace
+from typing import List, Optional
+
+from cache import cache_key
+from ingest import GOP_SECONDS
+
+# Timeline layout.
+VOICE_START_SECONDS = 2 #Delay to begin dialouge
+VOICE_GAP_SECONDS = 1 #Silence between lines
+FADE_SECONDS = 1
+MUSIC_GAIN = 0.5
+DEFAULT_SIZE = [1920, 1080]
+DEFAULT_FPS = 30
+
+# Path of the dialogue track. Its audio is mixed in memory (see audio.py) and handed to the executor, not read from
+# disk. The plan identifies the lines by their voice_keys.
+DIALOGUE_INPUT = "pipe:0"
+
+# Preview tier: small, low frame rate and fast to encode, rendered from the same plan before the full video.
+PREVIEW_HEIGHT = 360
+PREVIEW_FPS = 12
+PREVIEW_PRESET = "ultrafast"
+
+# Fragmented MP4 can be played while it is still being written, see /video-stream in api.py.
+FRAGMENTED_OUTPUT = True
+
+### PLAN DATA ###
+
+#One shot on the timeline. The source is looped `loops` times and played from in_point to out_point.
+#normalized marks a copy made by ingest.py, which executors may cut on keyframes without re-encoding.
+@dataclass
+class Shot_Segment:
+    path: str
+    in_point: float
+    out_point: float
+    loops: int = 1
+    normalized: bool = False
+
+    @property
+    def duration(self):
+        return self.out_point - self.in_point
+
+#One audio track, placed at `start` seconds and cut to [in_point, out_point) of its source (None plays to the end).
+@dataclass
+class Audio_Track:
+    path: str
+    start: float
+    gain: float = 1.0
+    in_point: float = 0.0
+    out_point: Optional[float] = None
+    kind: str = "dialogue" # "dialogue" or "music"
+
+@dataclass
+class Output_Settings:
+    path: str
+    size: List[int] = field(default_factory=lambda: list(DEFAULT_SIZE))
+    fps: float = DEFAULT_FPS
+    video_codec: str = "libx264"
+    audio_codec: str = "aac"
+    pixel_format: str = "yuv420p"
+    fragmented: bool = FRAGMENTED_OUTPUT
+    preset: Optional[str] = None # Encoder speed preset, None keeps the encoder's default
+
+#Everything an executor needs to produce a video, with no reference to how it will be produced. The decoded
+#dialogue travels next to the plan: voice_keys names each line by its TTS cache key (see return_voice_clip in
+#main.py), so an executor sharing that cache can fetch it, and voice_starts says where each line begins.
+@dataclass
+class Render_Plan:
+    shots: List[Shot_Segment]
+    audio: List[Audio_Track]
+    output: Output_Settings
+    fade_in: float = FADE_SECONDS
+    fade_out: float = FADE_SECONDS
+    voice_starts: List[float] = field(default_factory=list)
+    voice_keys: List[str] = field(default_factory=list)
+
+    @property
+    def length(self):
+        return sum(shot.duration for shot in self.shots)
+
+    def to_dict(self):
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            shots=[Shot_Segment(**shot) for shot in data["shots"]],
+            audio=[Audio_Track(**track) for track in data["audio"]],
+            output=Output_Settings(**data["output"]),
+            fade_in=data["fade_in"],
+            fade_out=data["fade_out"],
+            voice_starts=data.get("voice_starts", []),
+            voice_keys=data.get("voice_keys", [])
+        )
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), sort_keys=True)
+
+    @classmethod
+    def from_json(cls, text):
+        return cls.from_dict(json.loads(text))
+
+    #Identifies what the video will look and sound like, dialogue included through voice_keys. The output path
+    #is left out, so the same render requested for two users hashes the same.
+    def plan_hash(self):
+        data = self.to_dict()
+        data["output"] = dict(data["output"], path=None)
+        return cache_key(data)
+
+    #Same plan, written somewhere else and/or with different output settings.
+    def with_output(self, **changes):
+        return replace(self, output=replace(self.output, **changes))
+
+    #Same shots and audio at preview quality, written to path. Sizes stay even, as yuv420p needs.
+    def preview(self, path):
+        width, height = self.output.size
+        preview_height = min(height, PREVIEW_HEIGHT) // 2 * 2
+        preview_width = max(2, round(width * preview_height / height / 2) * 2)
+        return self.with_output(path=path, size=[preview_width, preview_height], fps=min(self.output.fps, PREVIEW_FPS),
+                                preset=PREVIEW_PRESET)
+
+### PLANNER ###
+
+#Splits the video into `slots` shots of about equal length. Every cut but the last lands on a whole GOP, i.e. a
+#keyframe of normalized footage, so the shots between them can be copied instead of re-encoded.
+def slot_lengths(total_length, slots):
+    shot_length = total_length / slots
+    if shot_length < GOP_SECONDS:
+        return [shot_length] * slots
+    cuts = [round(slot * shot_length / GOP_SECONDS) * GOP_SECONDS for slot in range(slots)] + [total_length]
+    return [end - start for start, end in zip(cuts, cuts[1:])]
+
+#Lays out a video from the type's shot comp and the length of each dialogue line. voice_keys (optional) are the
+#lines' TTS cache keys, recorded so the plan says what is spoken and not just for how long. Touches no files: shot
+#and music facts come from the asset catalog, so it is cheap enough to run thousands of times a second. Slots with
+#no footage and missing music are left out quietly, Video_Type.preload in main.py reports them once at startup.
+def build_render_plan(video_type, voice_durations, catalog, output_path, rng=random, voice_keys=None):
+    #Voice audio layout, the lines are mixed onto one dialogue track that starts with the video.
+    audio = []
+    voice_starts = []
+    current_start_seconds = VOICE_START_SECONDS
+    for duration in voice_durations:
+        voice_starts.append(current_start_seconds)
+        current_start_seconds += duration + VOICE_GAP_SECONDS
+    if voice_starts:
+        audio.append(Audio_Track(path=DIALOGUE_INPUT, start=0.0))
+
+    #Uses shot comp list to pick the footage.
+    shot_lists = {shot_type: catalog.shot_list(video_type.video_code, shot_type) for shot_type in set(video_type.shot_comp)}
+    total_film_length = current_start_seconds #length of audio plus buffer
+    shot_lengths = slot_lengths(total_film_length, len(video_type.shot_comp))
+    shots = []
+    first_entry = None
+    for shot_type, shot_length in zip(video_type.shot_comp, shot_lengths):
+        current_shot_list = shot_lists[shot_type]
+        if not current_shot_list:
+            continue
+
+        entry = current_shot_list.pop(rng.randint(0, len(current_shot_list)-1)) #Grab a random shot and pop
+        first_entry = first_entry or entry
+        shots.append(Shot_Segment(
+            path=entry["path"],
+            in_point=0.0,
+            out_point=shot_length,
+            loops=max(1, math.ceil(shot_length / entry["duration"])), #Short clips are looped to fill their slot
+            normalized=entry["normalized"]
+        ))
+
+    music_entry = catalog.music_track(video_type.music)
+    if music_entry is not None:
+        audio.append(Audio_Track(path=music_entry["path"], start=0.0, gain=MUSIC_GAIN, out_point=sum(shot.duration for shot in shots), kind="music"))
+
+    #Output format follows the first shot, which is the normalized format once footage is ingested.
+    output = Output_Settings(path=output_path)
+    if first_entry is not None:
+        output.size = list(first_entry["size"] or DEFAULT_SIZE)
+        output.fps = first_entry["fps"] or DEFAULT_FPS
+
+    return Render_Plan(shots=shots, audio=audio, output=output, voice_starts=voice_starts, voice_keys=list(voice_keys or []))
@@ -0,0 +1,78 @@
+# Script templates: narration written as text with named, typed slots, e.g.
+#
+#   "Welcome to {company:Company Name}! Every {day:Noun} at {company} is a rewarding experience!"
+#
+# {name:Type} declares a slot the user fills in, {name} reuses it. The prompts shown to the user are the slot types
+# in order of first appearance, and {{ / }} write literal braces. Templates are compiled once into format strings,
+# so rendering is a single str.format call per line.
+#
+# Each doc type is a JSON file in scripts/:
+#   {"video_code": "...", "music": "file in music/", "voice": "JACOB", "shot_comp": ["est", "reg", ...], "lines": [...]}
+
+# Standard python imports
+import os
+import re
+import json
+
+SCRIPTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "scripts")
+
+_SLOT = re.compile(r"\{\{|\}\}|\{([A-Za-z_][A-Za-z0-9_]*)(?::([^{}]+))?\}|[{}]")
+
+class Script_Template:
+    def __init__(self, video_code, lines, music, voice, shot_comp):
+        self.video_code = video_code
+        self.music = music
+        self.voice = voice
+        self.shot_comp = list(shot_comp)
+        self.slot_names = [] # In order of first appearance
+        self.prompts = [] # Type of each slot, what the user is asked for
+        self.formats = [self._compile(line) for line in lines]
+
+    #Turns one line into a str.format string whose fields are slot positions. Raises ValueError on bad syntax.
+    def _compile(self, line):
+        parts = []
+        position = 0
+        for match in _SLOT.finditer(line):
+            parts.append(line[position:match.start()])
+            position = match.end()
+            token = match.group(0)
+            if token in ("{{", "}}"):
+                parts.append(token)
+                continue
+            name, slot_type = match.group(1), match.group(2)
+            if name is None:
+                raise ValueError("%s: stray '%s' in %r" % (self.video_code, token, line))
+            if name not in self.slot_names:
+                if slot_type is None:
+                    raise ValueError("%s: {%s} is used before it is declared with a type" % (self.video_code, name))
+                self.slot_names.append(name)
+                self.prompts.append(slot_type.strip())
+            elif slot_type is not None:
+                raise ValueError("%s: slot {%s} is declared twice" % (self.video_code, name))
+            parts.append("{%d}" % self.slot_names.index(name))
+        parts.append(line[position:])
+        return "".join(parts)
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["video_code"], data["lines"], data["music"], data["voice"], data["shot_comp"])
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            return cls.from_dict(json.load(f))
+
+    #Fills the slots in with words (in prompt order) and returns the script, one string per line.
+    def render(self, words):
+        if len(words) < len(self.prompts):
+            raise Exception("Invalid Script Arguments: " + str(len(words)))
+        return [line.format(*words) for line in self.formats]
+
+#Loads every template in a folder, keyed by video code.
+def load_templates(directory=SCRIPTS_DIR):
+    templates = {}
+    for file_name in sorted(os.listdir(directory)):
+        if file_name.endswith(".json"):
+            template = Script_Template.load(os.path.join(directory, file_name))
+            templates[template.video_code] = template
+    return templates
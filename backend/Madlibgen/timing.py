@@ -0,0 +1,122 @@
+# Per-request timing spans for the render pipeline, and the histograms /metrics serves from them.
+#
+# A render opens a Timeline, and every span() or record_span() call made while it is active (including from
+# threads started with contextvars.copy_context().run) lands in it. Spans are plain dicts, so a render process
+# can hand them back to the web server, which aggregates them and optionally appends them to a JSON lines log.
+
+# Standard python imports
+import os
+import json
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+
+# Set MADLIB_TIMING_LOG (e.g. to timing.txt) to append one JSON line per render.
+TIMING_LOG = os.environ.get("MADLIB_TIMING_LOG")
+
+# Histogram bucket upper bounds, in seconds.
+BUCKETS = [0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300]
+
+_current_timeline = contextvars.ContextVar("timeline", default=None)
+
+class Timeline:
+    def __init__(self):
+        self.spans = []
+        self.started = time.perf_counter()
+        self.lock = threading.Lock()
+
+    def add(self, name, seconds, attrs):
+        with self.lock:
+            self.spans.append(dict(attrs, name=name, seconds=round(seconds, 6), offset=round(time.perf_counter() - self.started - seconds, 6)))
+
+#Collects every span recorded inside the block, yields the Timeline.
+@contextmanager
+def timeline():
+    current = Timeline()
+    token = _current_timeline.set(current)
+    try:
+        yield current
+    finally:
+        _current_timeline.reset(token)
+
+#Records a span measured elsewhere. Does nothing outside of a timeline.
+def record_span(name, seconds, **attrs):
+    current = _current_timeline.get()
+    if current is not None:
+        current.add(name, seconds, attrs)
+
+#Times the block as a span. The yielded dict can be filled in with extra facts (bytes, media seconds...).
+@contextmanager
+def span(name, **attrs):
+    start = time.perf_counter()
+    try:
+        yield attrs
+    finally:
+        record_span(name, time.perf_counter() - start, **attrs)
+
+### AGGREGATION (web server side) ###
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = list(buckets)
+        self.counts = [0] * (len(self.buckets) + 1) # Last slot counts everything above the largest bucket
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.bytes = 0
+        self.media_seconds = 0.0
+
+    def observe(self, seconds, bytes=0, media_seconds=0.0):
+        index = 0
+        while index < len(self.buckets) and seconds > self.buckets[index]:
+            index += 1
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+        self.bytes += bytes
+        self.media_seconds += media_seconds
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "sum_seconds": round(self.sum, 6),
+            "mean_seconds": round(self.sum / self.count, 6) if self.count else 0.0,
+            "max_seconds": round(self.max, 6),
+            "bytes": self.bytes,
+            "media_seconds": round(self.media_seconds, 3),
+            "buckets": {("le_" + str(bound)): count for bound, count in zip(self.buckets + ["inf"], self.counts)},
+        }
+
+class Metrics_Registry:
+    def __init__(self, log_path=TIMING_LOG):
+        self.histograms = {}
+        self.caches = {} # cache name -> hits, misses and evictions summed over every render
+        self.log_path = log_path
+        self.lock = threading.Lock()
+
+    #Adds a finished render's spans to the histograms and the log, and its cache counters (name -> counter -> count,
+    #optional) to the totals. extra is copied into the log line.
+    def observe_render(self, spans, caches=None, **extra):
+        with self.lock:
+            for recorded in spans:
+                histogram = self.histograms.setdefault(recorded["name"], Histogram())
+                histogram.observe(recorded["seconds"], recorded.get("bytes", 0), recorded.get("media_seconds", 0.0))
+            for name, counters in (caches or {}).items():
+                totals = self.caches.setdefault(name, {})
+                for counter, count in counters.items():
+                    totals[counter] = totals.get(counter, 0) + count
+            if self.log_path:
+                with open(self.log_path, "a") as f:
+                    f.write(json.dumps(dict(extra, time=time.time(), spans=spans, caches=caches or {})) + "\n")
+
+    def snapshot(self):
+        with self.lock:
+            return {name: histogram.snapshot() for name, histogram in sorted(self.histograms.items())}
+
+    def cache_snapshot(self):
+        with self.lock:
+            return {name: dict(counters) for name, counters in self.caches.items()}
+
+METRICS = Metrics_Registry()
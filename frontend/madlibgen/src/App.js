@@ -67,6 +67,30 @@ function App() {
 
   // ###### API REQUESTS ###### //
 
+  // Polls a queued render until it is finished, then fetches the video.
+  const waitForVideo = async (jobId) => {
+    while (true) {
+      const response = await fetch(`http://localhost:5000/video-status/${jobId}`);
+      if (!response.ok) {
+        throw new Error(`HTTP error! Status: ${response.status}`);
+      }
+      const status = await response.json();
+      if (status.status === 'failed') {
+        throw new Error(status.error);
+      }
+      if (status.status === 'done') {
+        break;
+      }
+      await timeout(2000); // Check again in 2 seconds
+    }
+
+    const response = await fetch(`http://localhost:5000/video-result/${jobId}`);
+    if (!response.ok) {
+      throw new Error(`HTTP error! Status: ${response.status}`);
+    }
+    return response.blob();
+  };
+
   // Fetches video from Flask API
   const generateVideo = () => {
     return new Promise((resolve, reject) => {
@@ -94,8 +118,9 @@ function App() {
           if (!response.ok) {
             throw new Error(`HTTP error! Status: ${response.status}`);
           }
-          return response.blob();
+          return response.json();
         })
+        .then(job => waitForVideo(job.job_id)) // The backend queues the render, so we poll until it is done.
         .then(blob => {
           // Create a URL for the video blob
           console.log(blob)